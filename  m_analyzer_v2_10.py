@@ -5,6 +5,7 @@ from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime, timedelta
 import asyncio
 import re
+from minrepo_store import ModelCatalog, mark_removed, rolling_means
 
 # ==========================================
 # BLOCK: 1. 固定設定
@@ -27,13 +28,8 @@ def calculate_machine_rate(total_diff, total_games):
     return round(((total_games * 3) + total_diff) / (total_games * 3) * 100, 2)
 
 def calculate_ma(data_list, window):
-    ma_list = []
-    for i in range(len(data_list)):
-        start = max(0, i - window + 1)
-        subset = data_list[start:i+1]
-        avg = sum(subset) / len(subset)
-        ma_list.append(round(avg, 2))
-    return ma_list
+    # 先頭の欠けた窓は実在日数で割る（共通カーネルで一括計算）
+    return [round(v, 2) for v in rolling_means([data_list], [window])[window][0].tolist()]
 
 # ==========================================
 # BLOCK: 3. 機種目録エンジン
@@ -62,7 +58,7 @@ def update_model_index_v2(doc, all_data):
         avg_g = int(s['sum_g'] / len(s['days'])) if s['days'] else 0
         info = [s['store'], name, len(s['units']), s['last_dt'].strftime("%Y/%m/%d"), avg_g]
         if s['last_dt'] >= active_threshold: active_list.append(info)
-        else: info[1] = f"[撤去] {info[1]}"; withdrawn_list.append(info)
+        else: info[1] = mark_removed(info[1]); withdrawn_list.append(info)
 
     active_list.sort(key=lambda x: x[4], reverse=True)
     index_rows = [["店舗名", "機種名", "設置台数", "最終稼働日", "平均稼働G"]] + active_list + withdrawn_list
@@ -88,6 +84,9 @@ async def run_analysis():
     conf = {"store": c_vals[1][1], "mode": c_vals[2][1], "A": [v[1] for v in c_vals[4:14] if v[1]], "B": [v[1] for v in c_vals[15:25] if v[1]], "C": [v[1] for v in c_vals[26:36] if v[1]]}
 
     print(f"--- 2. トレンド分析(MA)を実行中... ({conf['mode']}) ---")
+    # 部門判定（部分一致）は機種IDごとに1回だけ
+    catalog = ModelCatalog(row[2] for row in all_data[1:] if len(row) > 2)
+    group_ids = {k: catalog.ids_matching(conf[k], exact=False) for k in ['A', 'B', 'C']}
     daily_stats = {}
     for row in all_data[1:]:
         try:
@@ -96,9 +95,9 @@ async def run_analysis():
             entry = {'diff': int(row[4]), 'games': int(row[5])}
             if d_date not in daily_stats: daily_stats[d_date] = {'all': [], 'A': [], 'B': [], 'C': []}
             daily_stats[d_date]['all'].append(entry)
-            if any(m in d_model for m in conf['A']): daily_stats[d_date]['A'].append(entry)
-            if any(m in d_model for m in conf['B']): daily_stats[d_date]['B'].append(entry)
-            if any(m in d_model for m in conf['C']): daily_stats[d_date]['C'].append(entry)
+            mid = catalog.id_of(d_model)
+            for k, ids in group_ids.items():
+                if mid in ids: daily_stats[d_date][k].append(entry)
         except: continue
 
     sorted_dates = sorted(daily_stats.keys(), reverse=False)
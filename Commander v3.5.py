@@ -4,8 +4,8 @@ import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime
 import asyncio
-import csv
 import json
+from minrepo_store import ModelCatalog, iter_csv_rows, rolling_means
 
 # ==========================================
 # BLOCK: 1. 固定設定
@@ -31,7 +31,7 @@ def get_number_format(mode):
 # ==========================================
 # BLOCK: 3. クロス分析エンジン（リミッター＆カウンター搭載）
 # ==========================================
-async def execute_cross_analysis(doc, conf, all_data):
+async def execute_cross_analysis(doc, conf, db_path):
     print("   > クロス分析を開始...")
     
     # 軸設定の適用
@@ -42,19 +42,18 @@ async def execute_cross_analysis(doc, conf, all_data):
     else: # 差枚
         min_v, max_v, midpoint = -600, 600, 0
 
+    # 流し読みしながら日別・部門別に「稼働台数・差枚合計・G数合計」だけを積み上げる
+    catalog, groups = ModelCatalog(), {}
     daily_stats = {}
-    for row in all_data[1:]:
-        try:
-            d_date, d_store, d_model, d_unit, d_diff, d_games = [c.strip() for c in row]
-            if conf['store'] not in d_store: continue
-            entry = {'diff': int(d_diff), 'games': int(d_games)}
-            if d_date not in daily_stats: daily_stats[d_date] = {'all': [], 'A': [], 'B': [], 'C': []}
-            daily_stats[d_date]['all'].append(entry)
-            clean_m = d_model.replace("[撤去] ", "")
-            if any(clean_m == m for m in conf['A_list']): daily_stats[d_date]['A'].append(entry)
-            if any(clean_m == m for m in conf['B_list']): daily_stats[d_date]['B'].append(entry)
-            if any(clean_m == m for m in conf['C_list']): daily_stats[d_date]['C'].append(entry)
-        except: continue
+    for d_date, d_store, d_model, d_unit, d_diff, d_games in iter_csv_rows(db_path, store=conf['store']):
+        if d_date not in daily_stats: daily_stats[d_date] = {k: [0, 0, 0] for k in ['all', 'A', 'B', 'C']}
+        if d_games <= 0: continue
+        # 部門判定は機種IDごとに1回だけ
+        mid = catalog.id_of(d_model)
+        if mid not in groups: groups[mid] = ['all'] + [k for k in ['A', 'B', 'C'] if catalog.matches(mid, conf[f'{k}_list'])]
+        for k in groups[mid]:
+            acc = daily_stats[d_date][k]
+            acc[0] += 1; acc[1] += d_diff; acc[2] += d_games
 
     sorted_dates = sorted(daily_stats.keys())
     base_vals = {'all': [], 'A': [], 'B': [], 'C': []}
@@ -63,22 +62,23 @@ async def execute_cross_analysis(doc, conf, all_data):
     for d_str in sorted_dates:
         day = daily_stats[d_str]
         for k in base_vals.keys():
-            active = [e for e in day[k] if e['games'] > 0]
-            if not active: 
+            n, t_d, t_g = day[k]
+            if not n: 
                 base_vals[k].append(midpoint)
                 continue
             
-            if conf['mode'] == "差枚": val = sum(e['diff'] for e in active) / len(active)
-            elif conf['mode'] == "G数": val = sum(e['games'] for e in active) / len(active)
+            if conf['mode'] == "差枚": val = t_d / n
+            elif conf['mode'] == "G数": val = t_g / n
             else: # 機械割
-                t_d, t_g = sum(e['diff'] for e in active), sum(e['games'] for e in active)
                 val = ((t_g * 3 + t_d) / (t_g * 3) * 100) if t_g > 0 else 100
             
             if val < min_v or val > max_v: overflow_count += 1
             base_vals[k].append(round(val, 2))
 
     # 移動平均の計算
-    ma_results = {w: {k: [round(v, 2) for v in (lambda data, win: [sum(data[max(0, i-win+1):i+1])/len(data[max(0, i-win+1):i+1]) for i in range(len(data))])(base_vals[k], w)] for k in base_vals.keys()} for w in [3, 7, 15]}
+    keys = list(base_vals.keys())
+    means = rolling_means([base_vals[k] for k in keys], [3, 7, 15])
+    ma_results = {w: {k: [round(v, 2) for v in means[w][j].tolist()] for j, k in enumerate(keys)} for w in [3, 7, 15]}
 
     # シート準備（消さずにクリア）
     ws = doc.worksheet(CROSS_SHEET)
@@ -143,20 +143,16 @@ async def execute_cross_analysis(doc, conf, all_data):
 # ==========================================
 # BLOCK: 4. 単独機種分析（表示形式適正化版）
 # ==========================================
-async def execute_single_analysis(doc, conf, all_data):
+async def execute_single_analysis(doc, conf, db_path):
     if not conf['target_model']: return
     print(f"   > 単独機種分析: {conf['target_model']}")
     
     model_data = {}
     unique_units = set()
-    for row in all_data[1:]:
-        try:
-            d_date, d_store, d_model, d_unit, d_diff, d_games = [c.strip() for c in row]
-            if conf['store'] in d_store and conf['target_model'] in d_model:
-                unique_units.add(d_unit)
-                if d_date not in model_data: model_data[d_date] = {}
-                model_data[d_date][d_unit] = {'diff': int(d_diff), 'games': int(d_games)}
-        except: continue
+    for d_date, d_store, d_model, d_unit, d_diff, d_games in iter_csv_rows(db_path, store=conf['store'], model=conf['target_model']):
+        unique_units.add(d_unit)
+        if d_date not in model_data: model_data[d_date] = {}
+        model_data[d_date][d_unit] = {'diff': d_diff, 'games': d_games}
 
     if not unique_units: return
     sorted_units = sorted(list(unique_units), key=lambda x: int(x) if x.isdigit() else x)
@@ -219,9 +215,6 @@ async def main():
             
             if "実行" in str([all_cmd, single_cmd, cross_cmd]):
                 print(f"[{datetime.now().strftime('%H:%M:%S')}] 命令を受信。")
-                
-                with open(LOCAL_DATABASE, mode='r', encoding='utf-8-sig') as f:
-                    all_data = list(csv.reader(f))
 
                 conf = {
                     "store": vals[4][1], 
@@ -236,8 +229,9 @@ async def main():
                 target_cell = 'B2' if "実行" in all_cmd else ('C8' if "実行" in single_cmd else 'C10')
                 conf_ws.update_acell(target_cell, "● 実行中")
 
-                if "実行" in all_cmd or "実行" in cross_cmd: await execute_cross_analysis(doc, conf, all_data)
-                if "実行" in all_cmd or "実行" in single_cmd: await execute_single_analysis(doc, conf, all_data)
+                # CSVは各エンジンが流し読みする（全行をリスト化しない）
+                if "実行" in all_cmd or "実行" in cross_cmd: await execute_cross_analysis(doc, conf, LOCAL_DATABASE)
+                if "実行" in all_cmd or "実行" in single_cmd: await execute_single_analysis(doc, conf, LOCAL_DATABASE)
                 
                 conf_ws.update_acell(target_cell, "待機中")
                 print("   > 全工程完了。待機に戻ります。")
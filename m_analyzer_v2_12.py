@@ -4,16 +4,23 @@ import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime, timedelta
 import asyncio
+import json
+import os
 import re
+from minrepo_store import ModelCatalog, mark_removed, rolling_means
 
 # ==========================================
 # BLOCK: 1. 固定設定
 # ==========================================
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 SPREADSHEET_KEY = "1koHCi0l4KcsuMBEYSYRx_lklniibQHeCYaO_k-GUU1I"
 RAW_DATA_SHEET  = "生データ"
 CONFIG_SHEET    = "分析設定"
 CROSS_SHEET     = "クロス分析"
 INDEX_SHEET     = "機種目録"
+# 機種目録の集計状態（取り込み済みの行数と機種ごとの集計、前回シートへ書いた内容）
+INDEX_STATE_FILE = os.path.join(BASE_DIR, f"model_index_state_{SPREADSHEET_KEY}.json")
+INDEX_HEADER    = ["店舗名", "機種名", "設置台数", "最終稼働日", "平均稼働G"]
 
 # ==========================================
 # BLOCK: 2. 道具箱
@@ -27,48 +34,111 @@ def calculate_machine_rate(total_diff, total_games):
     return round(((total_games * 3) + total_diff) / (total_games * 3) * 100, 2)
 
 def calculate_ma(data_list, window):
-    ma_list = []
-    for i in range(len(data_list)):
-        start = max(0, i - window + 1)
-        subset = data_list[start:i+1]
-        avg = sum(subset) / len(subset)
-        ma_list.append(round(avg, 2))
-    return ma_list
+    # 先頭の欠けた窓は実在日数で割る（共通カーネルで一括計算）
+    return [round(v, 2) for v in rolling_means([data_list], [window])[window][0].tolist()]
 
 # ==========================================
 # BLOCK: 3. 機種目録エンジン（実稼働G対応）
 # ==========================================
-def update_model_index_v2(doc, all_data):
-    print("--- 1. 機種目録を更新中... ---")
-    all_dates = [datetime.strptime(r[0], "%Y/%m/%d") for r in all_data[1:] if r[0]]
-    max_date = max(all_dates) if all_dates else datetime.now()
-    active_threshold = max_date - timedelta(days=7)
+class ModelIndexState:
+    """生データの取り込み済み行数と機種ごとの集計を手元に持ち、次回は新しい行だけを足す"""
+    def __init__(self, path, state=None):
+        self.path = path
+        state = state or {}
+        self.rows_seen, self.last_row = state.get('rows_seen', 0), state.get('last_row')
+        self.max_date = state.get('max_date')
+        # 機種名 → {store, last, sum_g, days, units}（dict の並び＝初出順）
+        self.models = {name: dict(s, units=set(s['units'])) for name, s in state.get('models', {}).items()}
+        self.written = state.get('written')
 
-    model_stats = {}
-    for row in all_data[1:]:
-        try:
-            d_date_str, d_model, d_games = row[0], row[2], int(row[5])
-            if d_model not in model_stats:
-                model_stats[d_model] = {'store': row[1], 'last_dt': datetime.strptime(d_date_str, "%Y/%m/%d"), 'sum_g': 0, 'active_days_count': 0, 'units': set()}
-            if d_games > 0:
-                model_stats[d_model]['sum_g'] += d_games
-                model_stats[d_model]['active_days_count'] += 1
-            model_stats[d_model]['units'].add(row[3])
-            dt = datetime.strptime(d_date_str, "%Y/%m/%d")
-            if dt > model_stats[d_model]['last_dt']: model_stats[d_model]['last_dt'] = dt
-        except: continue
+    @classmethod
+    def load(cls, path=INDEX_STATE_FILE):
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f: return cls(path, json.load(f))
+            except (ValueError, KeyError): pass
+        return cls(path)
 
-    active_list, withdrawn_list = [], []
-    for name, s in model_stats.items():
-        avg_g = int(s['sum_g'] / s['active_days_count']) if s['active_days_count'] > 0 else 0
-        info = [s['store'], name, len(s['units']), s['last_dt'].strftime("%Y/%m/%d"), avg_g]
-        if s['last_dt'] >= active_threshold: active_list.append(info)
-        else: info[1] = f"[撤去] {info[1]}"; withdrawn_list.append(info)
+    def ingest(self, all_data):
+        """前回の続きから取り込む。行数が減った・前回の最終行が変わったときは全件やり直し"""
+        body = all_data[1:]
+        if len(body) < self.rows_seen or (self.rows_seen and body[self.rows_seen - 1] != self.last_row):
+            print("  生データが書き換えられているため、機種目録を全件から集計し直します")
+            self.__init__(self.path, {'written': self.written})
+        new_rows = body[self.rows_seen:]
+        # strptime は日付の種類ごとに1回だけ
+        parsed = {}
+        def to_dt(d_str):
+            if d_str not in parsed: parsed[d_str] = datetime.strptime(d_str, "%Y/%m/%d")
+            return parsed[d_str]
+        max_dt = to_dt(self.max_date) if self.max_date else None
+        for r in new_rows:
+            if r[0] and (max_dt is None or to_dt(r[0]) > max_dt): max_dt = to_dt(r[0])
+        for row in new_rows:
+            try:
+                d_date_str, d_model, d_games = row[0], row[2], int(row[5])
+                dt = to_dt(d_date_str)
+                s = self.models.get(d_model)
+                if s is None:
+                    s = self.models[d_model] = {'store': row[1], 'last': d_date_str, 'sum_g': 0, 'days': 0, 'units': set()}
+                if d_games > 0: s['sum_g'] += d_games; s['days'] += 1
+                s['units'].add(row[3])
+                if dt > to_dt(s['last']): s['last'] = d_date_str
+            except: continue
+        if max_dt is not None: self.max_date = max_dt.strftime("%Y/%m/%d")
+        self.rows_seen = len(body)
+        self.last_row = body[-1] if body else None
+        return len(new_rows)
 
-    active_list.sort(key=lambda x: x[4], reverse=True)
-    index_ws = doc.worksheet(INDEX_SHEET)
-    index_ws.clear()
-    index_ws.update(values=[["店舗名", "機種名", "設置台数", "最終稼働日", "平均稼働G"]] + active_list + withdrawn_list, range_name='A1')
+    def table(self):
+        """シートに書く表。稼働中/撤去の境目は最終稼働日との比較だけなので毎回その場で決める"""
+        max_date = datetime.strptime(self.max_date, "%Y/%m/%d") if self.max_date else datetime.now()
+        active_threshold = max_date - timedelta(days=7)
+        active_list, withdrawn_list = [], []
+        for name, s in self.models.items():
+            avg_g = int(s['sum_g'] / s['days']) if s['days'] > 0 else 0
+            last_dt = datetime.strptime(s['last'], "%Y/%m/%d")
+            info = [s['store'], name, len(s['units']), last_dt.strftime("%Y/%m/%d"), avg_g]
+            if last_dt >= active_threshold: active_list.append(info)
+            else: info[1] = mark_removed(info[1]); withdrawn_list.append(info)
+        active_list.sort(key=lambda x: x[4], reverse=True)
+        return [INDEX_HEADER] + active_list + withdrawn_list
+
+    def save(self):
+        state = {'rows_seen': self.rows_seen, 'last_row': self.last_row, 'max_date': self.max_date,
+                 'models': {name: dict(s, units=sorted(s['units'])) for name, s in self.models.items()}, 'written': self.written}
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f: json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+def write_index_diff(index_ws, old, new):
+    """前回書いた表と比べて、変わった行のまとまりだけを書き、余った末尾の行は消す"""
+    if old is None:
+        index_ws.clear()
+        index_ws.update(values=new, range_name='A1')
+        return len(new)
+    changed = [i for i in range(len(new)) if i >= len(old) or old[i] != new[i]]
+    blocks = []
+    for i in changed:
+        if blocks and blocks[-1][1] == i: blocks[-1][1] = i + 1
+        else: blocks.append([i, i + 1])
+    updates = [{'range': f'A{a + 1}:E{b}', 'values': new[a:b]} for a, b in blocks]
+    if updates: index_ws.batch_update(updates)
+    if len(old) > len(new): index_ws.batch_clear([f'A{len(new) + 1}:E{len(old)}'])
+    return len(changed)
+
+def update_model_index_v2(doc, all_data):
+    print("--- 1. 機種目録を更新中... ---")
+    state = ModelIndexState.load()
+    added = state.ingest(all_data)
+    table = state.table()
+    if table == state.written:
+        print(f"  機種目録に変化なし（新規 {added} 行）")
+    else:
+        n = write_index_diff(doc.worksheet(INDEX_SHEET), state.written, table)
+        print(f"  機種目録を更新: 新規 {added} 行 / 書き換え {n} 行")
+        state.written = table
+    state.save()
 
 # ==========================================
 # BLOCK: 4. 分析設定読み込み
@@ -97,6 +167,9 @@ async def run_analysis():
     conf = get_config_v3(doc)
 
     print(f"--- 2. クロス分析を実行中... ({conf['mode']}) ---")
+    # 部門判定は機種IDごとに1回だけ行い、行ごとの比較はIDの集合判定のみ
+    catalog = ModelCatalog(row[2] for row in all_data[1:] if len(row) > 2)
+    group_ids = {k: catalog.ids_matching(conf[f'{k}_list']) for k in ['A', 'B', 'C']}
     daily_stats = {}
     for row in all_data[1:]:
         try:
@@ -105,10 +178,9 @@ async def run_analysis():
             entry = {'diff': int(row[4]), 'games': int(row[5])}
             if d_date not in daily_stats: daily_stats[d_date] = {'all': [], 'A': [], 'B': [], 'C': []}
             daily_stats[d_date]['all'].append(entry)
-            clean_m = d_model.replace("[撤去] ", "")
-            if any(clean_m == m for m in conf['A_list']): daily_stats[d_date]['A'].append(entry)
-            if any(clean_m == m for m in conf['B_list']): daily_stats[d_date]['B'].append(entry)
-            if any(clean_m == m for m in conf['C_list']): daily_stats[d_date]['C'].append(entry)
+            mid = catalog.id_of(d_model)
+            for k, ids in group_ids.items():
+                if mid in ids: daily_stats[d_date][k].append(entry)
         except: continue
 
     sorted_dates = sorted(daily_stats.keys(), reverse=False)
@@ -124,7 +196,9 @@ async def run_analysis():
         for k in base_vals.keys(): base_vals[k].append(get_v(day[k]))
 
     # MA算出
-    ma_results = {w: {k: calculate_ma(v, w) for k, v in base_vals.items()} for w in [3, 7, 15]}
+    keys = list(base_vals.keys())
+    means = rolling_means([base_vals[k] for k in keys], [3, 7, 15])
+    ma_results = {w: {k: [round(v, 2) for v in means[w][j].tolist()] for j, k in enumerate(keys)} for w in [3, 7, 15]}
 
     # 表データ構築
     unit = "枚" if conf['mode'] == "差枚" else "G" if conf['mode'] == "G数" else "%"
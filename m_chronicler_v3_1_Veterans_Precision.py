@@ -3,10 +3,10 @@ import gspread
 from gspread.exceptions import WorksheetNotFound
 from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime, timedelta
-import csv
-import collections
+import json
 import os
-import math
+import numpy as np
+from minrepo_store import load_store, rolling_means
 
 # ==========================================
 # BLOCK: 1. 固定設定
@@ -20,108 +20,247 @@ LOCAL_DATABASE  = "/Users/macuser/Desktop/minrepo_project/minrepo_database.csv"
 VETERAN_DAYS = 90
 VETERAN_UNITS = 4
 
+# 機種ごとの集計状態（乖離ビンの勝敗カウンタ・直近の機械割・平均割の累計）を保持し、翌日からは追記分だけ足す
+CHRONICLE_STATE_FILE = os.path.join(BASE_DIR, "chronicler_state.json")
+# 判定に要る直近の店舗営業日数（MA30 の窓 + 翌3日 − 1）
+TAIL_DAYS = 32
+
 def calculate_payout(diff, games):
     if games <= 0: return 100.0
     return ((games * 3 + diff) / (max(1, games) * 3)) * 100
 
-def check_3_of_5(sorted_dts):
-    if len(sorted_dts) < 3: return False
-    for i in range(len(sorted_dts)-2):
-        if (sorted_dts[i+2] - sorted_dts[i]).days <= 4: return True
-    return False
+def payout_matrix(diff, games):
+    """calculate_payout の行列版（G数0の日は100.0）"""
+    g3 = np.maximum(games, 1) * 3
+    return np.where(games > 0, (games * 3 + diff) / g3 * 100, 100.0)
 
 # ==========================================
-# BLOCK: 2. 熟練機・精密分析エンジン
+# BLOCK: 2. 機種ごとの集計状態（追記分だけ更新）
 # ==========================================
-def run_veteran_analysis_v3_1():
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] ⏳ 全データロード及び精密熟練判定開始...")
-    db = collections.defaultdict(lambda: collections.defaultdict(lambda: collections.defaultdict(dict)))
-    
-    with open(LOCAL_DATABASE, mode='r', encoding='utf-8-sig') as f:
-        reader = csv.reader(f)
-        for row in reader:
-            if len(row) < 6: continue
+def reversal_bins(payouts):
+    """（機種 × 店舗営業日）機械割行列から、MA7/MA30乖離・翌3日平均・勝敗を一括計算し、
+    機種ごとに [ビン, 勝ち数, 検知数] の初出順リストを返す（全履歴から作るとき用）"""
+    n_models, n_days = payouts.shape
+    bins_of = [[] for _ in range(n_models)]
+    if not n_models or n_days < 34: return bins_of
+    mas = rolling_means(payouts, [3, 7, 30], fixed=True)
+
+    # 判定対象は i = 30 〜 n_days-4（翌3日平均は i+3 で終わる3日窓）
+    span = slice(30, n_days - 3)
+    ma30 = mas[30][:, span]
+    divergence = mas[7][:, span] - ma30
+    win = mas[3][:, 33:n_days] > ma30
+    rows, cols = np.nonzero(divergence < 0)
+    if not len(rows): return bins_of
+    bins = np.floor(divergence[rows, cols]).astype(np.int64)
+
+    # (機種, ビン) ごとの検知数・勝ち数をまとめて数える（行優先なので初出順も取れる）
+    b_min = int(bins.min())
+    keys = rows * (int(bins.max()) - b_min + 1) + (bins - b_min)
+    uniq, first, inv, total = np.unique(keys, return_index=True, return_inverse=True, return_counts=True)
+    wins = np.bincount(inv, weights=win[rows, cols], minlength=len(uniq)).astype(np.int64)
+    order = np.argsort(first, kind='stable')
+    for r, b, w, t in zip(rows[first[order]].tolist(), bins[first[order]].tolist(), wins[order].tolist(), total[order].tolist()):
+        bins_of[r].append([b, w, t])
+    return bins_of
+
+def fold_observations(entry, payouts, offset, start):
+    """payouts は店舗営業日 offset 番目以降の機械割。判定日 i >= start のうち翌3日が揃ったもの
+    （i = 30 〜 営業日数-4）の MA7/MA30 乖離ビンと勝敗を、日付順に bins へ足す（初出順を保つ）"""
+    lo, hi = max(30, start), offset + len(payouts) - 3
+    if hi <= lo: return
+    mas = rolling_means([payouts], [3, 7, 30], fixed=True)
+    j = np.arange(lo, hi) - offset
+    ma30 = mas[30][0][j]
+    divergence = mas[7][0][j] - ma30
+    win = mas[3][0][j + 3] > ma30
+    hit = divergence < 0
+    at = {b: k for k, (b, _w, _t) in enumerate(entry['bins'])}
+    for b, w in zip(np.floor(divergence[hit]).astype(np.int64).tolist(), win[hit].tolist()):
+        if b not in at: at[b] = len(entry['bins']); entry['bins'].append([b, 0, 0])
+        cell = entry['bins'][at[b]]
+        cell[1] += int(w); cell[2] += 1
+
+def best_bin(entry):
+    """初出順に見て最初の最大勝率のビン（5件以上）。(ビン, 勝率, 試行回数)"""
+    best = (None, 0, 0)
+    for b, w, t in entry['bins']:
+        wr = w / t
+        if t >= 5 and wr > best[1]: best = (b, wr, t)
+    return best
+
+class ChronicleState:
+    """店舗ごとの営業日数・最終日と、(店舗, 機種) ごとの集計状態。取り込み済みの行数までを反映する。
+    機種ごとに 初日・最終日とその日の稼働台数・生存台数・生存台の機械割の累計と件数・
+    直近 TAIL_DAYS 営業日の機械割・乖離ビンごとの [ビン, 勝ち数, 検知数] を持つ"""
+    def __init__(self, path, data=None):
+        data = data or {}
+        self.path = path
+        self.generation, self.n_rows = data.get('generation'), data.get('n_rows', 0)
+        self.stores = data.get('stores', {})
+
+    @classmethod
+    def load(cls, path=CHRONICLE_STATE_FILE):
+        if os.path.exists(path):
             try:
-                d_date, d_store, d_model, d_unit, d_diff, d_games = [c.strip() for c in row]
-                dt = datetime.strptime(d_date, "%Y/%m/%d")
-                db[d_store][d_model][int(d_unit)][dt] = {'diff': int(d_diff), 'games': int(d_games)}
-            except: continue
+                with open(path, encoding='utf-8') as f: return cls(path, json.load(f))
+            except ValueError: print("【警告】集計状態が読めないため、全履歴から作り直します")
+        return cls(path)
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'generation': self.generation, 'n_rows': self.n_rows, 'stores': self.stores}, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    @staticmethod
+    def _grid(store_days, d, df, g):
+        """生存台の行を店舗営業日の格子へ（稼働の無い日は G数0 → 機械割100.0）"""
+        diff, games = np.zeros(len(store_days), dtype=np.int64), np.zeros(len(store_days), dtype=np.int64)
+        pos = np.searchsorted(store_days, d)
+        np.add.at(diff, pos, df); np.add.at(games, pos, g)
+        return payout_matrix(diff, games), games, np.unique(pos)
+
+    def _base(self, store, sid, mid, store_days):
+        """全履歴から乖離ビン以外を作り、店舗営業日ごとの機械割も返す（機種×日の集計キューブから。行は読まない）"""
+        days, daily = store.model_daily(sid, mid)
+        entry = {'first_day': int(days[0]), 'last_day': int(days[-1]), 'last_units': int(daily['units'][-1]),
+                 'units': len(store.eligible_units(sid, mid)), 'base_sum': 0.0, 'base_n': 0, 'tail': [], 'bins': []}
+        # 生存台の稼働した日だけを格子へ
+        e = daily['e_units'] > 0
+        payouts, _games, live = self._grid(store_days, days[e], daily['e_diff'][e], daily['e_games'][e])
+        # 機種平均割は生存台の稼働日だけを日付順に足す
+        for p in payouts[live].tolist(): entry['base_sum'] += p
+        entry['base_n'] = len(live)
+        entry['tail'] = payouts[-TAIL_DAYS:].tolist()
+        return entry, payouts
+
+    def _build(self, store, sid, mid, store_days):
+        entry, payouts = self._base(store, sid, mid, store_days)
+        entry['bins'] = reversal_bins(payouts[None, :])[0]
+        return entry
+
+    def _extend(self, store, sid, mid, entry, rows, new_days, n_old):
+        """新しい営業日 new_days だけを足す。rows はその機種の追記行（無ければ全日 100.0）"""
+        if rows is not None and len(rows):
+            u, d, df, g = store.model_rows(sid, mid, rows)
+            entry['first_day'] = min(entry['first_day'], int(d.min()))
+            entry['last_day'], entry['last_units'] = int(d.max()), int((d == d.max()).sum())
+            m = np.isin(u, list(store.eligible_units(sid, mid)))
+            payouts, _games, live = self._grid(new_days, d[m], df[m], g[m])
+            for p in payouts[live].tolist(): entry['base_sum'] += p
+            entry['base_n'] += len(live)
+        else:
+            payouts = np.full(len(new_days), 100.0)
+        combined = np.concatenate([np.array(entry['tail'], dtype=np.float64), payouts])
+        fold_observations(entry, combined, n_old - len(entry['tail']), n_old - 3)
+        entry['tail'] = combined[-TAIL_DAYS:].tolist()
+
+    def _build_store(self, store, sid, store_days):
+        """店舗の全機種を全履歴から。乖離ビンは店舗単位の行列でまとめて数える"""
+        built = [(store.models[mid], *self._base(store, sid, mid, store_days)) for mid in store.store_models(sid)]
+        matrix = np.array([p for _m, _e, p in built]).reshape(len(built), len(store_days))
+        for (_m, entry, _p), bins in zip(built, reversal_bins(matrix)): entry['bins'] = bins
+        return {'n_days': len(store_days), 'last_day': int(store_days[-1]), 'models': {m: e for m, e, _p in built}}
+
+    def sync(self, store):
+        """列形式データの取り込み状況に合わせる。再構築されていれば全店舗、追記なら追記行のある店舗だけ"""
+        days_of = lambda sid: np.unique(store.cs_key[np.searchsorted(store.cs_key, sid << 32):np.searchsorted(store.cs_key, (sid + 1) << 32)] & 0xFFFFFFFF)
+        if self.generation != store.generation or self.n_rows > store.n_rows:
+            self.stores = {}
+            for sid, name in enumerate(store.stores):
+                store_days = days_of(sid)
+                if len(store_days): self.stores[name] = self._build_store(store, sid, store_days)
+            touched = len(self.stores)
+        else:
+            delta = np.arange(self.n_rows, store.n_rows)
+            mid_of = {m: i for i, m in enumerate(store.models)}
+            touched = 0
+            for sid in np.unique(store.store[delta]).tolist():
+                touched += 1
+                name, store_days = store.stores[sid], days_of(sid)
+                s_rows = delta[store.store[delta] == sid]
+                st = self.stores.get(name)
+                # 店舗が新しい、または途中に営業日が差し込まれた → 店舗ごと作り直す
+                if st is None or int(np.searchsorted(store_days, st['last_day'], side='right')) != st['n_days']:
+                    self.stores[name] = self._build_store(store, sid, store_days); continue
+                n_old, old_last = st['n_days'], st['last_day']
+                new_days = store_days[n_old:]
+                # 追記行を機種ごとに分ける（機種は追記分の中での初出順）
+                m_ids = store.model[s_rows]
+                uniq, first = np.unique(m_ids, return_index=True)
+                by_model = {store.models[mid]: (mid, s_rows[m_ids == mid]) for mid in uniq[np.argsort(first)].tolist()}
+                models = st['models']
+                for model, entry in models.items():
+                    mid, rows = by_model.get(model, (mid_of[model], None))
+                    if rows is not None and (int(store.day[rows].min()) <= old_last or len(store.eligible_units(sid, mid)) != entry['units']):
+                        # 過去日の行が届いた・新たに生存台が出た → その機種だけ全履歴から作り直す
+                        models[model] = self._build(store, sid, mid, store_days)
+                    elif len(new_days):
+                        self._extend(store, sid, mid, entry, rows, new_days, n_old)
+                # 新しい機種は初出順に末尾へ
+                for model, (mid, _rows) in by_model.items():
+                    if model not in models: models[model] = self._build(store, sid, mid, store_days)
+                st['n_days'], st['last_day'] = len(store_days), int(store_days[-1])
+        self.generation, self.n_rows = store.generation, store.n_rows
+        return touched
+
+# ==========================================
+# BLOCK: 3. 熟練機・精密分析エンジン
+# ==========================================
+def run_veteran_analysis_v3_1(state_path=CHRONICLE_STATE_FILE):
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] ⏳ 全データロード及び精密熟練判定開始...")
+    # 列形式データの追記分だけを機種ごとの集計状態へ足し込む（初回・再構築時のみ全履歴）
+    store_map = load_store(LOCAL_DATABASE)
+    state = ChronicleState.load(state_path)
+    touched = state.sync(store_map)
+    state.save()
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] 集計状態を更新しました（{touched} 店舗）。")
 
     results = []
 
-    for store, models in db.items():
-        all_store_dates = sorted(list(set(dt for m in models.values() for u in m.values() for dt in u.keys())))
-        if not all_store_dates: continue
-        latest_date = all_store_dates[-1]
+    for store in store_map.stores:
+        st = state.stores.get(store)
+        if not st: continue
+        latest_day = st['last_day']
 
-        # 店舗平均（看板/補欠判定用）
-        st_diff = sum(u_d['diff'] for m in models.values() for u in m.values() for u_d in u.values())
-        st_games = sum(u_d['games'] for m in models.values() for u in m.values() for u_d in u.values())
+        # 店舗平均（看板/補欠判定用）は日次集計キューブから
+        _, st_daily = store_map.store_daily(store, exact=True)
+        st_diff, st_games = int(st_daily['diff'].sum()), int(st_daily['games'].sum())
         store_base = calculate_payout(st_diff, st_games)
 
-        for model, units in models.items():
-            unit_count = len([u_id for u_id, hist in units.items() if latest_date in hist])
-            m_all_dates = sorted(list(set(dt for u in units.values() for dt in u.keys())))
-            installation_days = (m_all_dates[-1] - m_all_dates[0]).days if m_all_dates else 0
+        for model, e in st['models'].items():
+            unit_count = e['last_units'] if e['last_day'] == latest_day else 0
+            installation_days = e['last_day'] - e['first_day']
             
             # 熟練判定
             is_veteran = (installation_days >= VETERAN_DAYS and unit_count >= VETERAN_UNITS)
             
-            model_history = collections.defaultdict(lambda: {'diff': 0, 'games': 0})
-            for u_id, hist in units.items():
-                if check_3_of_5(sorted(list(hist.keys()))):
-                    for d, val in hist.items():
-                        model_history[d]['diff'] += val['diff']; model_history[d]['games'] += val['games']
-            
-            if not model_history: continue
+            if not e['base_n']: continue
             
-            m_payouts_raw = [calculate_payout(model_history[d]['diff'], model_history[d]['games']) for d in m_all_dates if d in model_history]
-            model_base = sum(m_payouts_raw) / len(m_payouts_raw) if m_payouts_raw else 100.0
+            model_base = e['base_sum'] / e['base_n']
             handle_type = "看板" if model_base > store_base else "補欠"
 
             target_point = "N/A"
             reversal_win_rate = "N/A"
             trial_count = "N/A"
 
-            if is_veteran:
-                all_payouts_filled = [calculate_payout(model_history[d]['diff'], model_history[d]['games']) if d in model_history else 100.0 for d in all_store_dates]
-                
-                bin_stats = collections.defaultdict(lambda: {"wins": 0, "total": 0})
-                for i in range(30, len(all_payouts_filled)-3):
-                    ma7 = sum(all_payouts_filled[i-6:i+1]) / 7
-                    ma30 = sum(all_payouts_filled[i-29:i+1]) / 30
-                    divergence = ma7 - ma30
-                    if divergence < 0:
-                        div_bin = math.floor(divergence)
-                        f_pay = sum(all_payouts_filled[i+1:i+4]) / 3
-                        bin_stats[div_bin]["total"] += 1
-                        if f_pay > ma30: bin_stats[div_bin]["wins"] += 1
-                
-                best_bin = None
-                max_wr = 0
-                count_at_best = 0
-                for b, s in bin_stats.items():
-                    wr = s["wins"] / s["total"]
-                    if s["total"] >= 5 and wr > max_wr:
-                        max_wr = wr
-                        best_bin = b
-                        count_at_best = s["total"]
-                
-                if best_bin is not None:
-                    target_point = f"{best_bin}%"
-                    reversal_win_rate = f"{max_wr*100:.1f}%"
-                    trial_count = count_at_best
-
-            results.append([
+            row = [
                 store, model, "熟練" if is_veteran else "一般", 
                 handle_type, f"{model_base:.2f}%", unit_count, 
                 f"{installation_days}日", target_point, reversal_win_rate, trial_count
-            ])
+            ]
+            # 熟練機は保持している乖離ビンの勝敗から反転臨界点を求める
+            if is_veteran:
+                best, max_wr, count_at_best = best_bin(e)
+                if best is not None:
+                    row[7:10] = [f"{best}%", f"{max_wr*100:.1f}%", count_at_best]
+            results.append(row)
 
     return results
 
 # ==========================================
-# BLOCK: 3. 納品
+# BLOCK: 4. 納品
 # ==========================================
 def deliver_veteran_tactics_v3_1(doc, data):
     print(f"[{datetime.now().strftime('%H:%M:%S')}] 🛠 スプレッドシート納品中...")
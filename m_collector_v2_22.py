@@ -4,13 +4,24 @@ import asyncio
 import random
 from playwright.async_api import async_playwright
 import gspread
+from gspread.exceptions import APIError
 from oauth2client.service_account import ServiceAccountCredentials
 import re
+import os
+import json
+import time
+import threading
 from datetime import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from minrepo_html import clean_number, spool_path, save_snapshot, parse_snapshot, PARSE_WORKERS
+from minrepo_store import append_csv_rows, refresh_store
 
 # ==========================================
 # BLOCK: 1. 司令塔（設定エリア）
 # ==========================================
+# 置き場所はすべてこのスクリプトのフォルダ基準（どこから起動しても各エンジンと同じCSVを使う）
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 START_DATE = "2024-12-27" 
 END_DATE   = "2026-01-31" 
 
@@ -29,6 +40,22 @@ TARGET_STORES = [
     }
 ]
 
+# 取得した日は、まず手元のデータベースへ書く（各エンジンはここを読む）
+LOCAL_DATABASE   = os.path.join(BASE_DIR, "minrepo_database.csv")
+# スプレッドシートへの写しは裏で送る。False ならシートへは書かない
+MIRROR_TO_SHEETS = True
+
+# シート書き込みのまとめ送り設定（何日分 or 何秒たまったら送るか）
+FLUSH_DAYS    = 10
+FLUSH_SECONDS = 120
+MAX_RETRY     = 6
+# 取得済み（日付, 店舗）の控え。無ければ初回だけカレンダーシートから作る
+MANIFEST_FILE = os.path.join(BASE_DIR, "collected_manifest_{sheet_id}.json")
+# シートへ送れなかった分の控え（取得済みリストの隣に置き、次の送信時・次回起動時に送り直す）
+PENDING_MIRROR_FILE = os.path.join(BASE_DIR, "pending_mirror_{sheet_id}.json")
+# True にすると、ページHTMLを html_spool へ保存し、解析は別プロセスに任せる（取得と解析を並行）
+SPOOL_HTML    = False
+
 # ==========================================
 # BLOCK: 2. 道具箱
 # ==========================================
@@ -44,16 +71,141 @@ def normalize_date(date_text):
         return dt.strftime("%Y/%m/%d")
     except: return None
 
-def clean_number(text):
-    if not text or text == "-" or text == " " or text == "±0": return 0
-    normalized = text.replace('▲', '-').replace('－', '-').replace(',', '').strip()
-    match = re.search(r'(-?\d+)', normalized)
-    return int(match.group(1)) if match else 0
+class CollectedManifest:
+    """取得済みの（日付, 店舗）を日付ごとに引けるようにした手元の控え"""
+    def __init__(self, path, by_date=None):
+        self.path = path
+        self.by_date = by_date or {}
+
+    @classmethod
+    def load(cls, sheet_id, cal_sheet):
+        path = MANIFEST_FILE.format(sheet_id=sheet_id)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                return cls(path, {d: set(names) for d, names in json.load(f).items()})
+        print("  取得済みリストが無いため、カレンダーシートから作成します（初回のみ）...")
+        m = cls(path)
+        m.add_rows(cal_sheet.get_all_values())
+        m.save()
+        return m
+
+    def add_rows(self, cal_rows):
+        for row in cal_rows:
+            if len(row) > 1: self.by_date.setdefault(row[0], set()).add(row[1])
+
+    def has(self, date, store_name):
+        # 店名はキーワード一致（シート上の正式名に store_name が含まれるか）
+        return any(store_name in name for name in self.by_date.get(date, ()))
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({d: sorted(names) for d, names in self.by_date.items()}, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+class LocalDaySink:
+    """1日分の行をCSVへ一括追記し、列形式データベースへ即反映する（取得済みリストもここで更新）"""
+    def __init__(self, csv_path, manifest):
+        self.csv_path, self.manifest = csv_path, manifest
+
+    def write_day(self, date, real_name, rows):
+        append_csv_rows(self.csv_path, rows)
+        refresh_store(self.csv_path)
+        self.manifest.add_rows([[date, real_name]])
+        self.manifest.save()
+
+class SheetWriteBuffer:
+    """生データ・カレンダーの行を数日分ためて、シートごとに1回の append_rows で送る。
+    送信は裏のスレッドで順番に行うので、取得は待たされない。送れなかった分は控えに残して次に送り直す"""
+    def __init__(self, raw_sheet, cal_sheet, pending_path=None, max_days=FLUSH_DAYS, max_seconds=FLUSH_SECONDS, background=True):
+        self.raw_sheet, self.cal_sheet, self.pending_path = raw_sheet, cal_sheet, pending_path
+        self.max_days, self.max_seconds = max_days, max_seconds
+        self.raw_rows, self.cal_rows = [], []
+        self.since, self.timer = None, None
+        self.lock = threading.Lock()
+        self.sender = ThreadPoolExecutor(max_workers=1) if background else None
+        self.sending = []
+        # 前回送れずに残った分があれば、まずそれを送る
+        if pending_path and os.path.exists(pending_path): self._submit([], [])
+
+    def add(self, rows, cal_row):
+        with self.lock:
+            self.raw_rows.extend(rows)
+            self.cal_rows.append(cal_row)
+            if self.since is None:
+                self.since = time.monotonic()
+                # 次の日が来なくても、max_seconds たったら送る
+                self.timer = threading.Timer(self.max_seconds, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+            due = len(self.cal_rows) >= self.max_days or time.monotonic() - self.since >= self.max_seconds
+        if due: self.flush()
+
+    def flush(self):
+        with self.lock:
+            raw_rows, cal_rows = self.raw_rows, self.cal_rows
+            self.raw_rows, self.cal_rows, self.since = [], [], None
+            if self.timer: self.timer.cancel()
+            self.timer = None
+            if raw_rows or cal_rows: self._submit(raw_rows, cal_rows)
+
+    def _submit(self, raw_rows, cal_rows):
+        if self.sender: self.sending.append(self.sender.submit(self._send, raw_rows, cal_rows))
+        else: self._send(raw_rows, cal_rows)
+
+    def _load_pending(self):
+        if not (self.pending_path and os.path.exists(self.pending_path)): return []
+        with open(self.pending_path, encoding='utf-8') as f: return json.load(f)
+
+    def _save_pending(self, batches):
+        if not self.pending_path: return
+        if not batches:
+            if os.path.exists(self.pending_path): os.remove(self.pending_path)
+            return
+        tmp = self.pending_path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f: json.dump(batches, f, ensure_ascii=False)
+        os.replace(tmp, self.pending_path)
+
+    def _send(self, raw_rows, cal_rows):
+        # 送信は1本のスレッドで順番に行うので、控えの読み書きもここだけで足りる
+        batches = self._load_pending()
+        if raw_rows or cal_rows: batches.append({"raw": raw_rows, "cal": cal_rows})
+        for i, b in enumerate(batches):
+            # カレンダーは「取得済み」の印なので、生データを送り終えてから書く
+            try:
+                if b["raw"]:
+                    append_with_backoff(self.raw_sheet, b["raw"])
+                    b["raw"] = []  # 生データだけ届いた分は、再送でカレンダーだけ送る
+                if b["cal"]: append_with_backoff(self.cal_sheet, b["cal"])
+                print(f"    [書込] {len(b['cal'])}日分をシートへ送信しました")
+            except Exception as e:
+                dates = ", ".join(str(r[0]) for r in b["cal"])
+                print(f"    ⚠️ シートへの写しに失敗（{e}）。手元のデータベースには保存済み。次回送り直します: {dates}")
+                self._save_pending(batches[i:])
+                return
+        self._save_pending([])
+
+    def close(self):
+        """残りを送り、裏の送信がすべて終わるまで待つ"""
+        self.flush()
+        if self.sender: self.sender.shutdown(wait=True)
+
+def append_with_backoff(ws, rows):
+    """429(回数制限)や5xxのときは 2,4,8... 秒待って送り直す"""
+    for attempt in range(MAX_RETRY):
+        try:
+            return ws.append_rows(rows)
+        except APIError as e:
+            code = getattr(getattr(e, 'response', None), 'status_code', None)
+            if (code != 429 and not (code and code >= 500)) or attempt == MAX_RETRY - 1: raise
+            wait = 2 ** (attempt + 1) + random.uniform(0, 1)
+            print(f"    ⚠️ シートが混雑中({code})。{wait:.1f}秒後に再送します...")
+            time.sleep(wait)
 
 # ==========================================
 # BLOCK: 3. 偵察ロジック（自律型底引き網）
 # ==========================================
-async def get_filtered_tasks(page, store_url, store_name, existing_records):
+async def get_filtered_tasks(page, store_url, store_name, manifest):
     print(f"[{store_name}] への移動と自律型リストスキャンを開始...")
     await page.goto(store_url, wait_until="load")
     await page.bring_to_front()
@@ -93,16 +245,8 @@ async def get_filtered_tasks(page, store_url, store_name, existing_records):
         norm_date = normalize_date(date_match.group(0))
         if not norm_date: continue
         
-        # 【強化】既存レコードを「キーワード」で柔軟に検索して重複を徹底排除
-        is_duplicate = False
-        for record in existing_records:
-            # 「日付_店名」を分解して、日付が一致し、かつ店名にキーワードが含まれるか
-            if "_" in record:
-                rec_date, rec_name = record.split("_", 1)
-                if norm_date == rec_date and store_name in rec_name:
-                    is_duplicate = True
-                    break
-        if is_duplicate: continue
+        # 【強化】取得済みリストを日付で引き、店名は「キーワード」で柔軟に照合して重複を徹底排除
+        if manifest.has(norm_date, store_name): continue
 
         current_dt = datetime.strptime(norm_date, "%Y/%m/%d")
         if start_dt <= current_dt <= end_dt:
@@ -148,12 +292,35 @@ async def scrape_day_data(page, url, expected_name):
     }''')
     return data, extracted_store_name
 
+async def spool_day_html(page, url, expected_name, date):
+    """ページを開いてHTMLをそのまま保存するだけ（解析は parse_snapshot 側）"""
+    target_url = url + ("&" if "?" in url else "?") + "kishu=all"
+    await page.goto(target_url, wait_until="load")
+    # 固定5秒待ちの代わりに、表が出た時点で次へ進む
+    try: await page.wait_for_selector("table tr td", timeout=5000)
+    except Exception: pass
+
+    full_title = await page.title()
+    if expected_name not in full_title:
+        print(f"  [拒絶] 店名不一致（{full_title}）")
+        return None
+
+    path = spool_path(expected_name, date, url)
+    save_snapshot(path, await page.content())
+    return path
+
+def record_day(sink, mirror, date, real_name, rows):
+    t_diff, t_games = sum(r[4] for r in rows), sum(r[5] for r in rows)
+    sink.write_day(date, real_name, rows)
+    if mirror: mirror.add(rows, [date, real_name, len(rows), t_diff, int(t_diff/len(rows)) if len(rows)>0 else 0, t_games])
+    print(f"    -> {date} 完了 / {len(rows)}台 / 差枚 {t_diff}")
+
 # ==========================================
 # BLOCK: 5. 司令部
 # ==========================================
 async def main():
     scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-    creds = ServiceAccountCredentials.from_json_keyfile_name('credentials.json', scope)
+    creds = ServiceAccountCredentials.from_json_keyfile_name(os.path.join(BASE_DIR, 'credentials.json'), scope)
     gc = gspread.authorize(creds)
 
     print("\n--- プロジェクト・リレー Ver.2.22 ---")
@@ -178,24 +345,39 @@ async def main():
                 raw_sheet, cal_sheet = sheet.worksheet("生データ"), sheet.worksheet("カレンダー")
                 
                 print("  既存データの整合性を確認中...")
-                all_values = cal_sheet.get_all_values()
-                existing_records = [f"{row[0]}_{row[1]}" for row in all_values if len(row) > 1]
+                manifest = CollectedManifest.load(store['sheet_id'], cal_sheet)
 
-                tasks = await get_filtered_tasks(page, store['url'], store['name'], existing_records)
+                tasks = await get_filtered_tasks(page, store['url'], store['name'], manifest)
                 print(f"  新たに取得が必要なレポートを {len(tasks)} 件発見。")
 
-                for task in tasks:
-                    day_data, real_name = await scrape_day_data(page, task['url'], store['name'])
-                    if not day_data: continue
-
-                    rows = [[task['date'], real_name, r['name'], r['num'], clean_number(r['diff']), clean_number(r['games'])] for r in day_data]
-                    raw_sheet.append_rows(rows)
-                    
-                    t_diff, t_games = sum(r[4] for r in rows), sum(r[5] for r in rows)
-                    cal_sheet.append_row([task['date'], real_name, len(rows), t_diff, int(t_diff/len(rows)) if len(rows)>0 else 0, t_games])
-                    
-                    print(f"    -> {task['date']} 完了 / {len(rows)}台 / 差枚 {t_diff}")
-                    await asyncio.sleep(random.uniform(2, 4))
+                sink = LocalDaySink(LOCAL_DATABASE, manifest)
+                pending_path = PENDING_MIRROR_FILE.format(sheet_id=store['sheet_id'])
+                mirror = SheetWriteBuffer(raw_sheet, cal_sheet, pending_path) if MIRROR_TO_SHEETS else None
+                parser = ProcessPoolExecutor(max_workers=PARSE_WORKERS) if SPOOL_HTML else None
+                parsing = deque()
+                try:
+                    for task in tasks:
+                        if parser:
+                            path = await spool_day_html(page, task['url'], store['name'], task['date'])
+                            if path: parsing.append(parser.submit(parse_snapshot, path))
+                            # 解析が終わった分から、取得順のまま書き込みへ回す
+                            while parsing and parsing[0].done():
+                                date, rows, real_name = parsing.popleft().result()
+                                if rows: record_day(sink, mirror, date, real_name, rows)
+                        else:
+                            day_data, real_name = await scrape_day_data(page, task['url'], store['name'])
+                            if not day_data: continue
+
+                            rows = [[task['date'], real_name, r['name'], r['num'], clean_number(r['diff']), clean_number(r['games'])] for r in day_data]
+                            record_day(sink, mirror, task['date'], real_name, rows)
+                        await asyncio.sleep(random.uniform(2, 4))
+                finally:
+                    # 中断・エラー時も、取得済みの分は解析を待って必ず保存し、シートへも送り切る
+                    while parsing:
+                        date, rows, real_name = parsing.popleft().result()
+                        if rows: record_day(sink, mirror, date, real_name, rows)
+                    if parser: parser.shutdown()
+                    if mirror: mirror.close()
 
                 if store != [s for s in TARGET_STORES if s["active"]][-1]:
                     pause = random.uniform(20, 30)
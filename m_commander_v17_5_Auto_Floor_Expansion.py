@@ -4,13 +4,14 @@ from gspread.exceptions import WorksheetNotFound
 from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime, timedelta
 import asyncio
-import csv
 import collections
 import jpholiday
-import re
 import time
 import json
 import os
+import sys
+import numpy as np
+from minrepo_store import load_store, day_to_str, short_label, rolling_means
 
 # ==========================================
 # BLOCK: 1. 固定設定 ＆ 拠点定義
@@ -23,6 +24,10 @@ CONFIG_SHEET    = "【HQ】単店_個別機種_グループ比較"
 TEMPLATE_SHEET  = "TEMPLATE_SINGLE_v2"
 INDEX_SHEET     = "機種目録"
 
+# 店舗MA30のプロセス内キャッシュ（全ノード共用。件数とおおよその使用量で古い順に捨てる）
+BASELINE_CACHE_ENTRIES = 32
+BASELINE_CACHE_BYTES   = 64 * 1024 * 1024
+
 NODES = [
     {
         "owner": "PM本体",
@@ -45,6 +50,31 @@ def hex_to_rgb(hex_str):
 # ==========================================
 # BLOCK: 2. 管理台帳 ＆ 補助ロジック
 # ==========================================
+class BaselineCache:
+    """(店舗, データ版) をキーにした LRU。データ版が進んだ店舗の古い版はその場で捨てる"""
+    def __init__(self, max_entries=BASELINE_CACHE_ENTRIES, max_bytes=BASELINE_CACHE_BYTES):
+        self.max_entries, self.max_bytes = max_entries, max_bytes
+        self.items, self.nbytes = collections.OrderedDict(), 0
+
+    def get(self, store_name, version):
+        key = (store_name, version)
+        if key not in self.items: return None
+        self.items.move_to_end(key)
+        return self.items[key][0]
+
+    def put(self, store_name, version, value):
+        for key in [k for k in self.items if k[0] == store_name]: self._drop(key)
+        # 1日あたり（日付文字列＋小数＋辞書の枠）のおおよその大きさで見積もる
+        size = sys.getsizeof(value) + len(value) * 120
+        self.items[(store_name, version)] = (value, size); self.nbytes += size
+        while self.items and (len(self.items) > self.max_entries or self.nbytes > self.max_bytes):
+            self._drop(next(iter(self.items)))
+
+    def _drop(self, key):
+        self.nbytes -= self.items.pop(key)[1]
+
+baseline_cache = BaselineCache()
+
 def load_registry():
     if os.path.exists(REGISTRY_FILE):
         try:
@@ -119,49 +149,50 @@ def set_mega_signal(doc, text, color_hex, font_size=18):
 # BLOCK: 4. メイン分析エンジン (v17.5 自動拡幅 ＆ トリミング)
 # ==========================================
 async def execute_single_analysis(target_doc, conf, store_master_ma30):
-    m_clean = re.sub(r'スマスロ|パチスロ|\[.*?\]|^[LSP e]\s*|^\s+|\s+$', '', conf['target_model']).strip()
-    target_short = m_clean[:4]
-    match = re.search(r'([0-9]+|V|ZERO|覚醒|編|祭)$', m_clean)
-    if match: target_short += match.group(1)
+    target_short = short_label(conf['target_model'])
     
     print(f"   > [{conf['owner']}] 解析中: {target_short}")
     dow_names = ["月", "火", "水", "木", "金", "土", "日"]
     
-    unit_app, raw_data = collections.defaultdict(list), []
-    store_daily = collections.defaultdict(lambda: {'diff': 0, 'games': 0})
-    target_compare = re.sub(r'スマスロ|パチスロ|\[.*?\]|^\s+|\s+$', '', conf['target_model']).strip()
-
-    with open(LOCAL_DATABASE, mode='r', encoding='utf-8-sig') as f:
-        reader = csv.reader(f); next(reader, None)
-        for row in reader:
-            if len(row) < 6: continue
-            d_date, d_store, d_model, d_unit, d_diff, d_games = [c.strip() for c in row]
-            if conf['store'] not in d_store: continue
-            dt = datetime.strptime(d_date, "%Y/%m/%d")
-            store_daily[d_date]['diff'] += int(d_diff); store_daily[d_date]['games'] += int(d_games)
-            row_model_clean = re.sub(r'スマスロ|パチスロ|\[.*?\]|^\s+|\s+$', '', d_model).strip()
-            if row_model_clean == target_compare and conf['start_date'] <= dt <= conf['end_date']:
-                unit_app[int(d_unit)].append(dt); raw_data.append({'date': d_date, 'unit': int(d_unit), 'diff': int(d_diff), 'games': int(d_games)})
-
-    if not raw_data: return
-    valid_units = sorted([u for u, dts in unit_app.items() if any((sorted(dts)[i+2]-sorted(dts)[i]).days <= 4 for i in range(len(dts)-2))])
-    if not valid_units: return
+    # 機種カタログで対象機種をID化し、該当行だけを取り出す（行ごとの正規表現は不要）
+    store = load_store(LOCAL_DATABASE)
+    rows = store.rows_for_model(conf['store'], conf['target_model'])
+    labels = store.day_labels(as_datetime=False)
+    day, unit = store.day[rows], store.unit[rows]
+    sel = (day >= conf['start_date'].toordinal()) & (day <= conf['end_date'].toordinal())
+    if not sel.any(): return
+    day, unit, diff, games = day[sel], unit[sel], store.diff[rows][sel], store.games[rows][sel]
+
+    # 期間指定・複数店舗/表記ゆれの合算で台をまとめるため、3/5日判定は取り込み済みの表ではなくここで行う
+    # （台→日付の順に1回並べ、同じ台の2つ先の行との日数差を配列で見る）
+    order = np.lexsort((day, unit))
+    su, sd = unit[order], day[order]
+    hit = (su[2:] == su[:-2]) & (sd[2:] - sd[:-2] <= 4)
+    valid_units = np.unique(su[2:][hit])
+    if not len(valid_units): return
+
+    # 日付キーの配列配置：有効台の行を日付順に安定ソートし、日ごとの区間を境界で切る（日内は元の行順）
+    target_dates = [labels[d] for d in np.unique(day).tolist()]
+    keep = np.flatnonzero(np.isin(unit, valid_units))
+    keep = keep[np.argsort(day[keep], kind='stable')]
+    k_day, k_unit, k_diff, k_games = day[keep], unit[keep].tolist(), diff[keep].tolist(), games[keep].tolist()
+    days, starts = np.unique(k_day, return_index=True)
+    bounds = starts.tolist() + [len(keep)]
 
     model_data, unit_hist = collections.defaultdict(dict), collections.defaultdict(list)
     payout_h, games_h, dow_stats, digit_stats = [], [], collections.defaultdict(list), collections.defaultdict(list)
-    all_d, all_g = [], []
-    target_dates = sorted(list(set(r['date'] for r in raw_data)))
+    all_d, all_g = k_diff, k_games
 
-    for i, d_str in enumerate(target_dates):
-        day_units = [r for r in raw_data if r['date'] == d_str and r['unit'] in valid_units]
-        if not day_units: continue
-        t_d, t_g = sum(r['diff'] for r in day_units), sum(r['games'] for r in day_units)
-        u_cnt = len(day_units)
+    for j, d in enumerate(days.tolist()):
+        a, b = bounds[j], bounds[j + 1]
+        d_str, day_model = labels[d], {}
+        t_d, t_g = sum(k_diff[a:b]), sum(k_games[a:b])
+        u_cnt = b - a
         payout_h.append(((t_d + t_g*3)/(max(1,t_g)*3)*100) if t_g > 0 else 100.0); games_h.append(t_g / max(1, u_cnt))
-        for r in day_units:
-            model_data[d_str][r['unit']] = {'diff': r['diff'], 'games': r['games']}
-            unit_hist[r['unit']].append(r['diff']); all_d.append(r['diff']); all_g.append(r['games'])
-        dt = datetime.strptime(d_str, "%Y/%m/%d"); avg_d = t_d / max(1, u_cnt)
+        for u, df, g in zip(k_unit[a:b], k_diff[a:b], k_games[a:b]):
+            day_model[u] = {'diff': df, 'games': g}; unit_hist[u].append(df)
+        model_data[d_str] = day_model
+        dt = datetime.fromordinal(d); avg_d = t_d / max(1, u_cnt)
         dow_stats[dt.weekday()].append(avg_d); digit_stats[dt.day % 10].append(avg_d)
 
     periods = detect_periods_v17(model_data, target_dates)
@@ -224,14 +255,19 @@ async def execute_single_analysis(target_doc, conf, store_master_ma30):
     ws.update(values=[[f"{u}番" for u in valid_units_final]], range_name=f'I86:{gspread.utils.rowcol_to_a1(86, 9+len(valid_units_final)-1)}')
 
     d_rows, c_rows = [], []
+    ma_h = {w: m.tolist() for w, m in rolling_means([payout_h, games_h], [7, 30]).items()}
     for i, d_str in enumerate(target_dates):
         day_u = model_data.get(d_str, {}); u_cnt = len(day_u)
         if u_cnt == 0: continue
         t_d, t_g = sum(x['diff'] for x in day_u.values()), sum(x['games'] for x in day_u.values())
         w7, w30 = max(0, i-6), max(0, i-29)
-        ma7r, ma30r = sum(payout_h[w7:i+1])/len(payout_h[w7:i+1]), sum(payout_h[w30:i+1])/len(payout_h[w30:i+1])
+        if i < len(payout_h):
+            (ma7r, ma7g), (ma30r, ma30g) = (ma_h[7][0][i], ma_h[7][1][i]), (ma_h[30][0][i], ma_h[30][1][i])
+        else:
+            # 有効台の無い日があると payout_h は target_dates より短い。その分は従来どおりスライスで
+            ma7r, ma30r = sum(payout_h[w7:i+1])/len(payout_h[w7:i+1]), sum(payout_h[w30:i+1])/len(payout_h[w30:i+1])
+            ma7g, ma30g = sum(games_h[w7:i+1])/len(games_h[w7:i+1]), sum(games_h[w30:i+1])/len(games_h[w30:i+1])
         s_ma30 = store_master_ma30.get(d_str, 100.0)
-        ma7g, ma30g = sum(games_h[w7:i+1])/len(games_h[w7:i+1]), sum(games_h[w30:i+1])/len(games_h[w30:i+1])
         sticky = round(len([x for x in day_u.values() if x['games']>=5000 and x['diff']>0])/max(1, u_cnt)*100, 1)
         row = [d_str, ["月","火","水","木","金","土","日"][datetime.strptime(d_str, "%Y/%m/%d").weekday()], "", t_d, int(t_d/max(1, u_cnt)), int(t_g/max(1, u_cnt)), round((t_g*3+t_d)/(max(1,t_g)*3)*100,1), sticky]
         for u in valid_units_final: row.append(day_u[u]['diff'] if u in day_u else "")
@@ -280,25 +316,16 @@ async def sync_node_all(node):
     doc = node['doc']
     try:
         set_status_lamp(doc, "● 同期中...", "#00ffff")
-        unique_stores = set()
-        with open(LOCAL_DATABASE, mode='r', encoding='utf-8-sig') as f:
-            reader = csv.reader(f); next(reader, None)
-            for row in reader:
-                if node['allowed_stores'] is None or row[1] in node['allowed_stores']: unique_stores.add(row[1])
-        stores = sorted(list(unique_stores))
+        store = load_store(LOCAL_DATABASE)
+        stores = sorted(s for s in store.stores if node['allowed_stores'] is None or s in node['allowed_stores'])
         idx_ws = doc.worksheet(INDEX_SHEET); idx_ws.batch_clear(['A:B'])
         idx_ws.update(values=[["店舗リスト"]] + [[s] for s in stores], range_name='A1')
         
-        model_stats = collections.defaultdict(lambda: {'last7_g': 0, 'all_g': 0, 'all_d': 0, 'is_rem': False})
         cur_s = doc.worksheet(CONFIG_SHEET).acell('B5').value
         if cur_s:
-            with open(LOCAL_DATABASE, mode='r', encoding='utf-8-sig') as f:
-                reader = csv.reader(f); next(reader, None)
-                for row in reader:
-                    if cur_s in row[1]:
-                        model_stats[row[2]]['all_g'] += int(row[5]); model_stats[row[2]]['all_d'] += 1
-                        if "[撤去]" in row[2]: model_stats[row[2]]['is_rem'] = True
-            f_list = sorted(model_stats.keys(), key=lambda m: (not model_stats[m]['is_rem'], model_stats[m]['all_g']/max(1,model_stats[m]['all_d'])), reverse=True)
+            # 店舗別の機種目録は取り込み時に集計済み（行は読まない）。撤去機種を末尾に、1行あたりG数の多い順
+            models = store.store_catalog(cur_s)
+            f_list = [m[0] for m in sorted(models, key=lambda m: (not m[3], m[1]/max(1, m[2])), reverse=True)]
             idx_ws.update(values=[["店舗別機種リスト"]] + [[m] for m in f_list], range_name='B1')
             
         conf_ws = doc.worksheet(CONFIG_SHEET)
@@ -311,14 +338,21 @@ async def sync_node_all(node):
     except Exception as e: print(f"Sync Error: {e}")
 
 async def get_store_master_ma30(store_name):
-    daily_raw = collections.defaultdict(lambda: {'diff': 0, 'games': 0})
-    with open(LOCAL_DATABASE, mode='r', encoding='utf-8-sig') as f:
-        reader = csv.reader(f); next(reader, None)
-        for row in reader:
-            if store_name in row[1]: daily_raw[row[0]]['diff'] += int(row[4]); daily_raw[row[0]]['games'] += int(row[5])
-    sorted_days = sorted(daily_raw.keys())
-    p_h = [(daily_raw[d]['games']*3 + daily_raw[d]['diff'])/(max(1,daily_raw[d]['games'])*3)*100 for d in sorted_days]
-    return {d: sum(p_h[max(0, i-29):i+1])/max(1, len(p_h[max(0, i-29):i+1])) for i, d in enumerate(sorted_days)}
+    # 同じデータ版（再構築の世代＋取り込み済みの位置）なら前回の結果をそのまま返す
+    store = load_store(LOCAL_DATABASE)
+    version = (store.generation, store.source["offset"])
+    cached = baseline_cache.get(store_name, version)
+    if cached is not None: return cached
+    # 店舗の日次合計は生の行をそのまま合算する（重複行も数える。キューブは後勝ちで重複を除くので使わない）
+    rows = store.rows_for_store(store_name)
+    days, inv = np.unique(store.day[rows], return_inverse=True)
+    d_sum = np.bincount(inv, weights=store.diff[rows], minlength=len(days)).astype(np.int64).tolist()
+    g_sum = np.bincount(inv, weights=store.games[rows], minlength=len(days)).astype(np.int64).tolist()
+    sorted_days = [day_to_str(d) for d in days.tolist()]
+    p_h = [(g*3 + df)/(max(1,g)*3)*100 for df, g in zip(d_sum, g_sum)]
+    ma30 = dict(zip(sorted_days, rolling_means([p_h], [30])[30][0].tolist()))
+    baseline_cache.put(store_name, version, ma30)
+    return ma30
 
 async def cleanup_patrol(doc, node):
     reg = load_registry(); ss_id = doc.id
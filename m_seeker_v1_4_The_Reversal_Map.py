@@ -3,11 +3,15 @@ import gspread
 from gspread.exceptions import WorksheetNotFound
 from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime, timedelta
-import csv
 import collections
+import csv
 import os
 import math
+import sys
 import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from minrepo_store import load_store, open_shared, rolling_means, rolling_sums
 
 # ==========================================
 # BLOCK: 1. 固定設定
@@ -20,99 +24,123 @@ LOCAL_DATABASE  = "/Users/macuser/Desktop/minrepo_project/minrepo_database.csv"
 # 司令官指定：母集団の純化条件
 MIN_UNITS_STUDY = 5
 MIN_GAMES_STUDY = 2500
+# 司令官指定：MA7/MA30 で乖離を測り、翌日から3日間の実戦値で成否を見る
+SHORT_WINDOW    = 7
+LONG_WINDOW     = 30
+HORIZON_DAYS    = 3
+# 反転解析を並列に回すプロセス数（1なら直列）
+SEEKER_WORKERS  = os.cpu_count() or 1
+
+# パラメータ掃引（--sweep）の格子。全組み合わせを1回のデータ走査で評価する
+SWEEP_GRID = {
+    "short": [5, 7, 10], "long": [20, 30, 60], "horizon": [1, 3, 5],
+    "min_units": [3, 5, 8], "min_games": [2000, 2500, 3000]
+}
+SWEEP_CSV = os.path.join(BASE_DIR, "reversal_sweep.csv")
 
 def calculate_payout(diff, games):
     if games <= 0: return 100.0
     return ((games * 3 + diff) / (max(1, games) * 3)) * 100
 
-def check_3_of_5(sorted_dts):
-    """3/5日ルールの聖域：5日中3日の生存を台番号ごとに確認"""
-    if len(sorted_dts) < 3: return False
-    for i in range(len(sorted_dts)-2):
-        if (sorted_dts[i+2] - sorted_dts[i]).days <= 4: return True
-    return False
-
 # ==========================================
-# BLOCK: 2. 全軍反転解析エンジン
+# BLOCK: 2. 全軍反転解析エンジン（店舗×機種ごとに並列）
 # ==========================================
-def run_full_reversal_study():
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] 🔍 Seeker 全軍展開。全歴史から反転座標を抽出します...")
-    db = collections.defaultdict(lambda: collections.defaultdict(lambda: collections.defaultdict(dict)))
+def default_params():
+    return (SHORT_WINDOW, LONG_WINDOW, HORIZON_DAYS, MIN_UNITS_STUDY, MIN_GAMES_STUDY)
+
+def expand_grid(grid):
+    """格子 → (短期窓, 長期窓, 先読み日数, 最低台数, 最低MA短期G) の組の一覧（短期窓 < 長期窓のみ）"""
+    return [(sw, lw, h, mu, mg) for sw in grid["short"] for lw in grid["long"] if sw < lw
+            for h in grid["horizon"] for mu in grid["min_units"] for mg in grid["min_games"]]
+
+def simulate_model(units, survivors, all_store_dates, params_list=None):
+    """1機種分の反転シミュレーション。パラメータの組ごとに、検知の (乖離ビン, 成否, リフト) を発生順の配列で返す。
+    移動平均・先読み合計・足切り条件は組の間で共有し、日次配列は1回だけ作る"""
+    params_list = params_list or [default_params()]
+    # 1. 3/5ルールによる個体選別（取り込み時に判定済みの生存台）と時系列データの構築
+    model_history = collections.defaultdict(lambda: {'diff': 0, 'games': 0, 'u_count': 0})
+    for u_id, hist in units.items():
+        if u_id in survivors:
+            for d, val in hist.items():
+                model_history[d]['diff'] += val['diff']
+                model_history[d]['games'] += val['games']
+                model_history[d]['u_count'] += 1
     
-    with open(LOCAL_DATABASE, mode='r', encoding='utf-8-sig') as f:
-        reader = csv.reader(f)
-        for row in reader:
-            if len(row) < 6: continue
-            try:
-                d_date, d_store, d_model, d_unit, d_diff, d_games = [c.strip() for c in row]
-                dt = datetime.strptime(d_date, "%Y/%m/%d")
-                db[d_store][d_model][int(d_unit)][dt] = {'diff': int(d_diff), 'games': int(d_games)}
-            except: continue
-
-    # 機種別・乖離ビン別集計：reversal_stats[model][bin] = {wins, total, lift_sum}
-    reversal_stats = collections.defaultdict(lambda: collections.defaultdict(lambda: {"wins": 0, "total": 0, "lift_sum": 0.0}))
-
-    for store, models in db.items():
-        all_store_dates = sorted(list(set(dt for m in models.values() for u in m.values() for dt in u.keys())))
-        
-        for model, units in models.items():
-            # 1. 3/5ルールによる個体選別と時系列データの構築
-            model_history = collections.defaultdict(lambda: {'diff': 0, 'games': 0, 'u_count': 0})
-            for u_id, hist in units.items():
-                if check_3_of_5(sorted(list(hist.keys()))):
-                    for d, val in hist.items():
-                        model_history[d]['diff'] += val['diff']
-                        model_history[d]['games'] += val['games']
-                        model_history[d]['u_count'] += 1
-            
-            if not model_history: continue
-
-            # 2. 連続した日付リストに対してMA計算用の日次配列を作成
-            daily_stats = []
-            for d in all_store_dates:
-                if d in model_history and model_history[d]['u_count'] > 0:
-                    h = model_history[d]
-                    daily_stats.append({
-                        'payout': calculate_payout(h['diff'], h['games']),
-                        'avg_g': h['games'] / h['u_count'],
-                        'units': h['u_count']
-                    })
-                else:
-                    daily_stats.append({'payout': 100.0, 'avg_g': 0, 'units': 0})
-
-            # 3. 反転シミュレーション
-            for i in range(30, len(daily_stats) - 3):
-                # 司令官指定：5台以上 ＆ MA7G 2,500G以上の期間のみ抽出
-                current_units = daily_stats[i]['units']
-                ma7_g = sum(x['avg_g'] for x in daily_stats[max(0, i-6):i+1]) / 7
-                
-                if current_units < MIN_UNITS_STUDY or ma7_g < MIN_GAMES_STUDY:
-                    continue
-
-                # MA7とMA30の算出
-                ma7_p = sum(x['payout'] for x in daily_stats[max(0, i-6):i+1]) / 7
-                ma30_p = sum(x['payout'] for x in daily_stats[max(0, i-29):i+1]) / 30
-                divergence = ma7_p - ma30_p
-                
-                # 下方乖離（逆張りチャンス）を検知
-                if divergence < 0:
-                    div_bin = math.floor(divergence) # -3.4% -> -4%域として集計
-                    
-                    # 翌日から3日間の実戦値
-                    f_payouts = [daily_stats[k]['payout'] for k in range(i+1, i+4) if daily_stats[k]['units'] > 0]
-                    if not f_payouts: continue
-                    
-                    res_p3 = sum(f_payouts) / len(f_payouts)
-                    
-                    # 成功判定：その日のMA30（その機種の重力）を超えたか
-                    is_win = 1 if res_p3 > ma30_p else 0
-                    
+    if not model_history: return {}
+
+    # 2. 連続した日付リストに対してMA計算用の日次配列を作成
+    payout, avg_g, u_cnt = [], [], []
+    for d in all_store_dates:
+        if d in model_history and model_history[d]['u_count'] > 0:
+            h = model_history[d]
+            payout.append(calculate_payout(h['diff'], h['games'])); avg_g.append(h['games'] / h['u_count']); u_cnt.append(h['u_count'])
+        else:
+            payout.append(100.0); avg_g.append(0); u_cnt.append(0)
+    n = len(payout)
+    payout, u_cnt = np.array(payout), np.array(u_cnt)
+
+    # 3. 反転シミュレーション（MA は共通カーネルで全窓まとめて計算）
+    mas = rolling_means([avg_g, payout], sorted({p[0] for p in params_list} | {p[1] for p in params_list}), fixed=True)
+    # 翌日から h 日間のうち稼働日の実戦値：位置 i+h で終わる窓の合計（稼働の無い日は 0 を足すので素朴な合計と一致）
+    live = (u_cnt > 0).astype(np.int64)
+    fwd = {h: (rolling_sums(payout * live, h)[0], rolling_sums(live, h)[0]) for h in {p[2] for p in params_list}}
+    gates, out = {}, {}
+    for sw, lw, h, mu, mg in params_list:
+        if n - h <= lw: continue
+        # 司令官指定の足切り（台数 ＆ MA短期G）は同じ条件の組で使い回す
+        if (sw, mu, mg) not in gates: gates[(sw, mu, mg)] = (u_cnt >= mu) & (mas[sw][0] >= mg)
+        i = np.arange(lw, n - h)
+        f_sum, f_cnt = fwd[h][0][i + h], fwd[h][1][i + h]
+        ma_s, ma_l = mas[sw][1][i], mas[lw][1][i]
+        divergence = ma_s - ma_l
+        # 下方乖離（逆張りチャンス）で、先読み期間に稼働日があるもの
+        hit = gates[(sw, mu, mg)][i] & (divergence < 0) & (f_cnt > 0)
+        if not hit.any(): continue
+        res = f_sum[hit] / f_cnt[hit]
+        # -3.4% -> -4%域として集計 / 成功判定：その日の長期MA（その機種の重力）を超えたか
+        out[(sw, lw, h, mu, mg)] = (np.floor(divergence[hit]).astype(np.int64), (res > ma_l[hit]).astype(np.int64), res - ma_l[hit])
+    return out
+
+def study_unit(args):
+    """作業単位（1店舗の機種いくつか）を解く。プロセスプールの各ワーカーで実行"""
+    store_path, sid, mids, params_list = args
+    store = open_shared(store_path)
+    labels = store.day_labels(as_datetime=True)
+    all_store_dates = [labels[d] for d in np.unique(store.day[store.store_rows(sid)]).tolist()]
+    return [(store.models[mid], simulate_model(store.unit_history(sid, mid), store.eligible_units(sid, mid), all_store_dates, params_list)) for mid in mids]
+
+def plan_units(store, n_workers, params_list):
+    """店舗ごとの機種を、ワーカー数の数倍の作業単位に切り分ける（店舗順・初出順を保つ）"""
+    per_store = [(sid, store.store_models(sid)) for sid in range(len(store.stores))]
+    total = sum(len(m) for _, m in per_store)
+    size = max(1, math.ceil(total / (n_workers * 4)))
+    return [(store.path, sid, mids[k:k + size], params_list) for sid, mids in per_store for k in range(0, len(mids), size)]
+
+def collect_reversal_stats(params_list, workers=SEEKER_WORKERS):
+    """全店舗×全機種を1回走査し、組ごとに reversal_stats[組][model][bin] = {wins, total, lift_sum} を返す"""
+    store = load_store(LOCAL_DATABASE)
+    units = plan_units(store, workers, params_list)
+    print(f"  作業単位 {len(units)} 個を {workers} プロセスで解析します（パラメータ {len(params_list)} 組）...")
+    if workers > 1 and len(units) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(study_unit, units))
+    else:
+        results = [study_unit(u) for u in units]
+
+    # 直列実行と同じ順（店舗→機種→日付）で足し込むので、小数の合計もビット単位で一致する
+    stats = {p: collections.defaultdict(lambda: collections.defaultdict(lambda: {"wins": 0, "total": 0, "lift_sum": 0.0})) for p in params_list}
+    for part in results:
+        for model, events in part:
+            for params, (bins, wins, lifts) in events.items():
+                reversal_stats = stats[params]
+                for div_bin, is_win, lift in zip(bins.tolist(), wins.tolist(), lifts.tolist()):
                     s = reversal_stats[model][div_bin]
                     s["total"] += 1
                     s["wins"] += is_win
-                    s["lift_sum"] += (res_p3 - ma30_p)
+                    s["lift_sum"] += lift
+    return stats
 
-    # 4. レポート行の作成
+def report_rows_for(reversal_stats):
     report_rows = []
     for model, bins in reversal_stats.items():
         for div_bin, s in bins.items():
@@ -125,6 +153,26 @@ def run_full_reversal_study():
     report_rows.sort(key=lambda x: (x[0], x[5]))
     return report_rows
 
+def run_full_reversal_study(workers=SEEKER_WORKERS):
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] 🔍 Seeker 全軍展開。全歴史から反転座標を抽出します...")
+    params = default_params()
+    return report_rows_for(collect_reversal_stats([params], workers)[params])
+
+def run_reversal_sweep(grid=SWEEP_GRID, workers=SEEKER_WORKERS):
+    """格子の全組み合わせを1回の走査で評価する。戻り値は (組ごとの要約行, 組×機種×ビンの明細行)"""
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] 🔍 Seeker パラメータ掃引を開始します...")
+    params_list = expand_grid(grid)
+    stats = collect_reversal_stats(params_list, workers)
+    summary, detail = [], []
+    for params in params_list:
+        rows = report_rows_for(stats[params])
+        total = sum(r[2] for r in rows)
+        wins = sum(s["wins"] for bins in stats[params].values() for s in bins.values() if s["total"] >= 5)
+        lift = sum(s["lift_sum"] for bins in stats[params].values() for s in bins.values() if s["total"] >= 5)
+        summary.append(list(params) + [len(rows), total, f"{wins / max(1, total) * 100:.1f}%", f"{lift / max(1, total):+.2f}%"])
+        detail.extend(list(params) + r[:5] for r in rows)
+    return summary, detail
+
 # ==========================================
 # BLOCK: 3. スプレッドシート納品
 # ==========================================
@@ -146,8 +194,29 @@ def deliver_reversal_map(doc, data):
     ws.update(values=header + [row[:5] for row in data], range_name='A1')
     print(f"[{datetime.now().strftime('%H:%M:%S')}] ✅ 黄金の反転表、納品完了。")
 
+def deliver_sweep(doc, summary, detail):
+    """組ごとの要約はシートへ、組×機種×ビンの明細は手元のCSVへ"""
+    param_header = ["短期MA", "長期MA", "先読み日数", "最低台数", "最低MA短期G"]
+    with open(SWEEP_CSV, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(param_header + ["機種名", "乖離の深さ", "過去検知数", "反転成功率(対長期MA)", "平均リフト幅"])
+        writer.writerows(detail)
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] 📄 明細 {len(detail)} 行を {SWEEP_CSV} へ書き出しました。")
+    try:
+        ws = doc.worksheet("Sentinel_Reversal_Sweep")
+        ws.clear()
+    except WorksheetNotFound:
+        ws = doc.add_worksheet("Sentinel_Reversal_Sweep", len(summary) + 10, 10)
+    header = [param_header + ["有効ビン数", "過去検知数", "反転成功率(対長期MA)", "平均リフト幅"]]
+    time.sleep(1)
+    ws.update(values=header + summary, range_name='A1')
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] ✅ 掃引表（{len(summary)} 組）、納品完了。")
+
 if __name__ == "__main__":
     creds = ServiceAccountCredentials.from_json_keyfile_name(JSON_KEY_FILE, ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive'])
     gc = gspread.authorize(creds); doc = gc.open_by_key(SPREADSHEET_KEY)
-    map_data = run_full_reversal_study()
-    deliver_reversal_map(doc, map_data)
\ No newline at end of file
+    if "--sweep" in sys.argv:
+        deliver_sweep(doc, *run_reversal_sweep())
+    else:
+        map_data = run_full_reversal_study()
+        deliver_reversal_map(doc, map_data)
\ No newline at end of file
@@ -3,12 +3,15 @@ import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime, timedelta
 import asyncio
-import csv
-import collections
 import os
 import time
 import requests
 import hashlib
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from minrepo_store import load_store, open_shared, rolling_means, rolling_sums, day_to_str
 
 # ==========================================
 # BLOCK: 1. 固定設定
@@ -23,17 +26,25 @@ DISCORD_WEBHOOK_URL = "https://discord.com/api/webhooks/1471366357621805108/W9ab
 DISCORD_VALIDATION_WEBHOOK_URL = "https://discord.com/api/webhooks/1471366574438092972/3TVbePfZYzsGbafE8IU09Ucoipc5VMw8xQCHXJImYKxMVb8cwu28lx6czEGbq6phwsze" 
 
 SCAN_INTERVAL_SEC = 3600 
+# データ到着で哨戒する（CSVの更新を監視し、行が増えた店舗だけを再哨戒。定時の全店哨戒は SCAN_INTERVAL_SEC ごとの保険）
+EVENT_DRIVEN       = True
+WATCH_POLL_SEC     = 10
+WATCH_DEBOUNCE_SEC = 30
+# 機種ごとの移動平均・Alpha用の状態（直近31日分の出率と6ヶ月分の出率、最後のシグナル）を周期・再起動をまたいで保持する
+SIGNAL_STATE_FILE = os.path.join(BASE_DIR, "sentinel_signal_state.json")
+TAIL_DAYS  = 31
+ALPHA_DAYS = 180
+# 通知の設置台数フィルタ（この台数以下の機種は送らない）
+ALERT_UNIT_FLOOR = 3
+
+# 歴史検証（--backtest）：シグナル後の何営業日分の実戦値で成否を見るか / 店舗ごとに並列に回すプロセス数
+BACKTEST_HORIZONS = (1, 3, 7)
+BACKTEST_WORKERS  = os.cpu_count() or 1
 
 def calculate_payout(diff, games):
     if games <= 0: return 100.0
     return ((games * 3 + diff) / (max(1, games) * 3)) * 100
 
-def check_3_of_5(sorted_dts):
-    if len(sorted_dts) < 3: return False
-    for i in range(len(sorted_dts)-2):
-        if (sorted_dts[i+2] - sorted_dts[i]).days <= 4: return True
-    return False
-
 # ==========================================
 # BLOCK: 2. 戦術知能の同期 (Veterans Sync)
 # ==========================================
@@ -64,58 +75,145 @@ def load_veteran_brain(doc):
         return {}
 
 # ==========================================
-# BLOCK: 3. ハイブリッド哨戒エンジン
+# BLOCK: 3. 機種ごとの哨戒状態（追記分だけ更新）
 # ==========================================
-async def run_hybrid_scan(veteran_brain, doc):
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] ⚡️ 精密哨戒中（ハイブリッド・モード）...")
-    if not os.path.exists(LOCAL_DATABASE): return []
+def daily_payouts(d, df, g):
+    """生存台の行から日ごとの出率（calculate_payout と同じ値）。日付は生存台の稼働日のみ"""
+    p_dates, inv = np.unique(d, return_inverse=True)
+    p_diff = np.bincount(inv, weights=df, minlength=len(p_dates)).astype(np.int64)
+    p_games = np.bincount(inv, weights=g, minlength=len(p_dates)).astype(np.int64)
+    return p_dates, np.where(p_games > 0, (p_games * 3 + p_diff) / (np.maximum(1, p_games) * 3) * 100, 100.0)
 
-    # データロード
-    db = collections.defaultdict(lambda: collections.defaultdict(lambda: collections.defaultdict(dict)))
-    with open(LOCAL_DATABASE, mode='r', encoding='utf-8-sig') as f:
-        reader = csv.reader(f)
-        for row in reader:
-            if len(row) < 6: continue
+class SignalState:
+    """(店舗, 機種) ごとの哨戒状態。取り込み済みの行数までを反映しており、追記行だけで更新する。
+    機種ごとに 最終稼働日とその日の稼働台数・生存台数・出率の件数・直近 TAIL_DAYS 日の出率・6ヶ月分の (日, 出率)・最後のシグナル を持つ"""
+    def __init__(self, path, data=None):
+        data = data or {}
+        self.path = path
+        self.generation, self.n_rows = data.get('generation'), data.get('n_rows', 0)
+        self.stores = data.get('stores', {})
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path=SIGNAL_STATE_FILE):
+        if os.path.exists(path):
             try:
-                d_date, d_store, d_model, d_unit, d_diff, d_games = [c.strip() for c in row]
-                db[d_store][d_model][int(d_unit)][d_date] = {'diff': int(d_diff), 'games': int(d_games)}
-            except: continue
+                with open(path, encoding='utf-8') as f: return cls(path, json.load(f))
+            except ValueError: print("【警告】哨戒状態が読めないため、全履歴から作り直します")
+        return cls(path)
+
+    def save(self):
+        if not self.dirty: return
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'generation': self.generation, 'n_rows': self.n_rows, 'stores': self.stores}, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+    def _build(self, store, sid, mid):
+        # 全履歴は機種×日の集計キューブから（生存台の稼働した日の合計。行は読まない）
+        days, daily = store.model_daily(sid, mid)
+        e = daily['e_units'] > 0
+        p_dates, payouts = daily_payouts(days[e], daily['e_diff'][e], daily['e_games'][e])
+        entry = {'last_day': int(days[-1]), 'last_units': int(daily['units'][-1]), 'units': len(store.eligible_units(sid, mid)),
+                 'n': 0, 'tail': [], 'six': [], 'last_alert': None}
+        self._push(entry, p_dates, payouts)
+        return entry
+
+    @staticmethod
+    def _push(entry, p_dates, payouts):
+        entry['n'] += len(payouts)
+        entry['tail'] = (entry['tail'] + payouts.tolist())[-TAIL_DAYS:]
+        six = entry['six'] + [[d, p] for d, p in zip(p_dates.tolist(), payouts.tolist())]
+        entry['six'] = [x for x in six if x[0] >= entry['last_day'] - ALPHA_DAYS]
+
+    def _extend(self, store, sid, mid, entry, rows):
+        """最終稼働日より後の日だけが追記されたとき：その日々の出率を足すだけ"""
+        u, d, df, g = store.model_rows(sid, mid, rows)
+        m = np.isin(u, list(store.eligible_units(sid, mid)))
+        p_dates, payouts = daily_payouts(d[m], df[m], g[m])
+        entry['last_day'], entry['last_units'] = int(d.max()), int((d == d.max()).sum())
+        self._push(entry, p_dates, payouts)
+
+    def sync(self, store):
+        """列形式データの取り込み状況に合わせる。再構築されていれば全機種、追記なら追記行のある機種だけ"""
+        if self.generation != store.generation or self.n_rows > store.n_rows:
+            # CSVが書き換えられても、送信済みのシグナルは (店舗, 機種) ごとに引き継ぐ
+            old, self.stores = self.stores, {}
+            for sid, name in enumerate(store.stores):
+                self.stores[name] = {store.models[mid]: self._build(store, sid, mid) for mid in store.store_models(sid)}
+                for model, entry in self.stores[name].items():
+                    prev = old.get(name, {}).get(model)
+                    if prev is not None: entry['last_alert'] = prev['last_alert']
+            n_touched = sum(len(m) for m in self.stores.values())
+        else:
+            delta = np.arange(self.n_rows, store.n_rows)
+            keys = (store.store[delta].astype(np.int64) << 32) | store.model[delta].astype(np.int64)
+            uniq, first, inv = np.unique(keys, return_index=True, return_inverse=True)
+            n_touched = len(uniq)
+            for j in np.argsort(first, kind='stable').tolist():
+                sid, mid = int(uniq[j] >> 32), int(uniq[j] & 0xFFFFFFFF)
+                rows = delta[inv == j]
+                models = self.stores.setdefault(store.stores[sid], {})
+                entry = models.get(store.models[mid])
+                # 過去日の行が届いた・新たに生存台が出た → その機種だけ全履歴から作り直す（最後のシグナルは引き継ぐ）
+                if entry is None or int(store.day[rows].min()) <= entry['last_day'] or len(store.eligible_units(sid, mid)) != entry['units']:
+                    fresh = self._build(store, sid, mid)
+                    if entry is not None: fresh['last_alert'] = entry['last_alert']
+                    models[store.models[mid]] = fresh
+                else:
+                    self._extend(store, sid, mid, entry, rows)
+        if n_touched or self.generation != store.generation: self.dirty = True
+        self.generation, self.n_rows = store.generation, store.n_rows
+        return n_touched
+
+_signal_state = None
+
+def signal_state():
+    global _signal_state
+    if _signal_state is None: _signal_state = SignalState.load()
+    return _signal_state
+
+# ==========================================
+# BLOCK: 4. ハイブリッド哨戒エンジン
+# ==========================================
+async def run_hybrid_scan(veteran_brain, doc, stores=None):
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] ⚡️ 精密哨戒中（ハイブリッド・モード）..." + (f" 対象 {len(stores)} 店舗" if stores is not None else ""))
+    if not os.path.exists(LOCAL_DATABASE): return []
+
+    # データロード（共有マップを周期間で使い回し、CSVの追記分のみ取り込む）→ 機種ごとの状態へ追記分だけ反映
+    store_map = load_store(LOCAL_DATABASE)
+    state = signal_state()
+    state.sync(store_map)
     
     # 【検証報告処理の呼び出し】 (v2.8.1の機能を継承)
     # ※ここでは簡略化のため内部定義せず、以前の run_validation_process と同等のロジックを想定
     
     found_alerts = []
-    for store, models in db.items():
-        all_dates = sorted(list(set(d for m in models.values() for u in m.values() for d in u.keys())))
-        if not all_dates: continue
-        latest_date = all_dates[-1]
+    for sid, store in enumerate(store_map.stores):
+        if stores is not None and store not in stores: continue
+        # 店舗の日次合計は日次集計キューブから（日番号の昇順＝日付文字列の昇順）
+        st_days, st_daily = store_map.store_daily(store, exact=True)
+        if not len(st_days): continue
+        latest = int(st_days[-1])
+        latest_date = day_to_str(latest)
         dt_latest = datetime.strptime(latest_date, "%Y/%m/%d")
         
         # 6ヶ月Alpha用ベースライン
-        six_months_ago = (dt_latest - timedelta(days=180)).strftime("%Y/%m/%d")
-        st_6m_payouts = []
-        for d in all_dates:
-            if d >= six_months_ago:
-                d_diff = sum(u_d[d]['diff'] for m in models.values() for u_d in m.values() if d in u_d)
-                d_games = sum(u_d[d]['games'] for m in models.values() for u_d in m.values() if d in u_d)
-                if d_games > 0: st_6m_payouts.append(calculate_payout(d_diff, d_games))
+        six_ord = (dt_latest - timedelta(days=180)).toordinal()
+        st_6m_payouts = [calculate_payout(d_diff, d_games) for d, d_diff, d_games in zip(st_days.tolist(), st_daily['diff'].tolist(), st_daily['games'].tolist())
+                         if d >= six_ord and d_games > 0]
         store_6m_avg = sum(st_6m_payouts)/len(st_6m_payouts) if st_6m_payouts else 100.0
 
-        for model, units in models.items():
-            if not any(latest_date in u_hist for u_hist in units.values()): continue
-            unit_count = len([u_id for u_id, hist in units.items() if latest_date in hist])
-            
-            # 生存台集計
-            model_history = collections.defaultdict(lambda: {'diff': 0, 'games': 0})
-            for u_id, hist in units.items():
-                if check_3_of_5(sorted([datetime.strptime(d, "%Y/%m/%d") for d in hist.keys()])):
-                    for d, val in hist.items():
-                        model_history[d]['diff'] += val['diff']; model_history[d]['games'] += val['games']
+        for model, st in state.stores.get(store, {}).items():
+            # 最新日に稼働した機種だけ（台数は日次集計キューブの稼働台数）
+            if st['last_day'] != latest: continue
+            unit_count = st['last_units']
             
-            if not model_history: continue
-            p_dates = sorted(model_history.keys())
-            payouts = [calculate_payout(model_history[d]['diff'], model_history[d]['games']) for d in p_dates]
-            if len(payouts) < 31: continue
+            # 3/5日ルールの生存台による出率系列（直近分は状態に保持済み）
+            if st['n'] == 0: continue
+            payouts = st['tail']
+            if st['n'] < 31: continue
             
             # 現在値の算出
             ma7_now, ma30_now = sum(payouts[-7:])/7, sum(payouts[-30:])/30
@@ -123,7 +221,7 @@ async def run_hybrid_scan(veteran_brain, doc):
             current_divergence = ma7_now - ma30_now
             
             # 6ヶ月Alpha
-            m_6m_p = [calculate_payout(model_history[d]['diff'], model_history[d]['games']) for d in p_dates if d >= six_months_ago]
+            m_6m_p = [p for d, p in st['six'] if d >= six_ord]
             alpha = (sum(m_6m_p)/len(m_6m_p) - store_6m_avg) if m_6m_p else 0.0
 
             # 戦術データ照合
@@ -141,7 +239,8 @@ async def run_hybrid_scan(veteran_brain, doc):
                     if div_pre > vt["target_point"]:
                         alert_type = "REVERSAL"
 
-            if alert_type:
+            # 同じ日の同じシグナルは送信済み（再起動をまたいでも二度送らない）
+            if alert_type and st['last_alert'] != [alert_type, latest_date]:
                 tg_id = f"TG-{latest_date.replace('/','')}-{hashlib.md5((store+model+alert_type).encode()).hexdigest()[:4].upper()}"
                 found_alerts.append({
                     "type": alert_type, "store": store, "model": model, "date": latest_date,
@@ -150,10 +249,21 @@ async def run_hybrid_scan(veteran_brain, doc):
                     "div": round(current_divergence, 2),
                     "tg_id": tg_id, "tactical": vt
                 })
+    # 状態は周期ごとにディスクへ（再起動しても全履歴を読み直さない）
+    state.save()
     return found_alerts
 
+def mark_alerts_sent(alerts):
+    """送信を終えたシグナルを状態へ記録する（送信前に落ちたら、次の哨戒で送り直す）"""
+    state = signal_state()
+    for a in alerts:
+        st = state.stores.get(a['store'], {}).get(a['model'])
+        if st is not None:
+            st['last_alert'] = [a['type'], a['date']]; state.dirty = True
+    state.save()
+
 # ==========================================
-# BLOCK: 4. 報告処理（ハイブリッド通知フォーマット）
+# BLOCK: 5. 報告処理（ハイブリッド通知フォーマット）
 # ==========================================
 def send_hybrid_alert(alerts):
     for a in alerts:
@@ -189,17 +299,179 @@ def send_hybrid_alert(alerts):
             f"--- --- ---"
         )
         # 設置台数フィルタ（GCは3台以下スキップ。反転はそもそも熟練機=4台以上のみ）
-        if a['unit_count'] > 3:
+        if a['unit_count'] > ALERT_UNIT_FLOOR:
             requests.post(DISCORD_WEBHOOK_URL, json={"content": msg})
             time.sleep(1.0)
 
 # ==========================================
-# BLOCK: 5. メインループ
+# BLOCK: 6. 歴史検証（全日付でのシグナル再現と事後成績）
 # ==========================================
+def backtest_model(store, sid, mid, store_days, target_point):
+    """1機種について、店舗の各営業日を「最新日」とみなしたときの哨戒判定を一括で再現する。
+    生存台はその日までに3/5日ルールを満たした台だけを使うので、判定日が同じ区間ごとに系列を作り直す"""
+    u, d, df, g = store.model_rows(sid, mid)
+    if not len(d): return []
+    days_any, unit_count = np.unique(d, return_counts=True)
+
+    el = store.eligible_units(sid, mid)
+    if not el: return []
+    since = np.array([el.get(x, np.iinfo(np.int64).max) for x in u.tolist()], dtype=np.int64)
+    bounds = sorted(set(el.values())) + [np.iinfo(np.int64).max]
+    events = []
+    for f_from, f_to in zip(bounds[:-1], bounds[1:]):
+        cand = (days_any >= f_from) & (days_any < f_to) & (unit_count > ALERT_UNIT_FLOOR)
+        if not cand.any(): continue
+        # この区間の生存台だけで日次の出率系列を作る（日付は生存台の稼働日のみ）
+        m = since <= f_from
+        p_dates, payouts = daily_payouts(d[m], df[m], g[m])
+        mas = rolling_means([payouts], [7, 30], fixed=True)
+        ma7, ma30 = mas[7][0], mas[30][0]
+        dates, counts = days_any[cand], unit_count[cand]
+        k = np.searchsorted(p_dates, dates, side='right') - 1
+        ok = k >= 30
+        dates, counts, k = dates[ok], counts[ok], k[ok]
+        if not len(k): continue
+        ma7_now, ma30_now, ma7_pre, ma30_pre = ma7[k], ma30[k], ma7[k - 1], ma30[k - 1]
+        div, div_pre = ma7_now - ma30_now, ma7_pre - ma30_pre
+        # 1. GC（順張り） / 2. 反転臨界点（逆張り）：熟練機のみ、今日初めて臨界点に達した場合
+        gc = (ma7_now > ma30_now) & (ma7_pre <= ma30_pre)
+        rev = ~gc & (div <= target_point) & (div_pre > target_point) if target_point is not None else np.zeros(len(k), dtype=bool)
+        # 事後成績：シグナル日の翌営業日から h 日間のうち、この生存台が稼働した日の出率平均
+        grid_p, grid_live = np.zeros(len(store_days)), np.zeros(len(store_days), dtype=np.int64)
+        pos = np.searchsorted(store_days, p_dates)
+        grid_p[pos], grid_live[pos] = payouts, 1
+        at = np.searchsorted(store_days, dates)
+        fwd = {}
+        for h in BACKTEST_HORIZONS:
+            f_sum, f_cnt = rolling_sums(grid_p, h)[0], rolling_sums(grid_live, h)[0]
+            end = at + h
+            valid = end < len(store_days)
+            end = np.minimum(end, len(store_days) - 1)
+            fwd[h] = np.where(valid & (f_cnt[end] > 0), f_sum[end] / np.maximum(1, f_cnt[end]), np.nan)
+        for i in np.flatnonzero(gc | rev).tolist():
+            events.append({"type": "GC" if gc[i] else "REVERSAL", "model": store.models[mid], "date": day_to_str(int(dates[i])),
+                           "unit_count": int(counts[i]), "ma7": float(ma7_now[i]), "ma30": float(ma30_now[i]), "div": float(div[i]),
+                           "fwd": {h: (None if np.isnan(fwd[h][i]) else float(fwd[h][i])) for h in BACKTEST_HORIZONS}})
+    return events
+
+def backtest_store(args):
+    """1店舗分の歴史検証。プロセスプールの各ワーカーで実行"""
+    store_path, sid, tactics = args
+    store = open_shared(store_path)
+    store_days = np.unique(store.cs_key[np.searchsorted(store.cs_key, sid << 32):np.searchsorted(store.cs_key, (sid + 1) << 32)] & 0xFFFFFFFF)
+    events = []
+    for mid in store.store_models(sid):
+        vt = tactics.get(store.models[mid].strip(), {"is_veteran": False, "target_point": None})
+        tp = vt["target_point"] if vt["is_veteran"] else None
+        for e in backtest_model(store, sid, mid, store_days, tp):
+            e["store"] = store.stores[sid]; events.append(e)
+    return events
+
+def run_backtest(veteran_brain, workers=BACKTEST_WORKERS):
+    """全店舗×全機種×全営業日で GC / 反転シグナルを再現し、シグナル種別ごとの事後成績をまとめる"""
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] 🧪 歴史検証を開始します（{workers} プロセス）...")
+    store = load_store(LOCAL_DATABASE)
+    jobs = [(store.path, sid, {m: vt for (s, m), vt in veteran_brain.items() if s == name.strip()})
+            for sid, name in enumerate(store.stores)]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(backtest_store, jobs))
+    else:
+        parts = [backtest_store(j) for j in jobs]
+    events = [e for part in parts for e in part]
+
+    # シグナル種別×先読み日数ごと：件数・成功率（事後平均 > シグナル日のMA30）・平均出率・平均リフト
+    summary = []
+    for sig in ("GC", "REVERSAL"):
+        sig_events = [e for e in events if e["type"] == sig]
+        for h in BACKTEST_HORIZONS:
+            res = [(e["fwd"][h], e["ma30"]) for e in sig_events if e["fwd"][h] is not None]
+            wins = sum(1 for f, ma in res if f > ma)
+            summary.append([sig, f"{h}日", len(sig_events), len(res),
+                            f"{wins / max(1, len(res)) * 100:.1f}%",
+                            f"{sum(f for f, _ in res) / max(1, len(res)):.2f}%",
+                            f"{sum(f - ma for f, ma in res) / max(1, len(res)):+.2f}%"])
+    return summary, events
+
+def deliver_backtest(doc, summary):
+    try:
+        ws = doc.worksheet("Sentinel_Backtest")
+        ws.clear()
+    except gspread.exceptions.WorksheetNotFound:
+        ws = doc.add_worksheet("Sentinel_Backtest", 50, 10)
+    header = [["シグナル", "先読み", "発生数", "検証可能数", "成功率(対MA30)", "平均出率", "平均リフト幅"]]
+    ws.update(values=header + summary, range_name='A1')
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] ✅ 歴史検証の結果を納品しました。")
+
+# ==========================================
+# BLOCK: 7. メインループ
+# ==========================================
+def db_signature():
+    try:
+        st = os.stat(LOCAL_DATABASE)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError: return None
+
+def store_versions():
+    """店舗ごとの (世代, 行数)。追記なら行の増えた店舗だけが変わり、再構築なら全店舗が変わる"""
+    store_map = load_store(LOCAL_DATABASE)
+    return {name: (store_map.generation, n) for name, n in zip(store_map.stores, store_map.store_row_counts())}
+
+async def wait_for_data(last_sig, deadline):
+    """CSVの更新を待つ。変化を見つけたら、書き込みが WATCH_DEBOUNCE_SEC 秒落ち着くのを待ってから返す。
+    定時（deadline）までに変化が無ければ None"""
+    while time.monotonic() < deadline:
+        await asyncio.sleep(min(WATCH_POLL_SEC, max(0, deadline - time.monotonic())))
+        sig = db_signature()
+        if sig == last_sig: continue
+        while True:
+            await asyncio.sleep(WATCH_DEBOUNCE_SEC)
+            settled = db_signature()
+            if settled == sig: return sig
+            sig = settled
+    return None
+
+async def watch_loop(doc):
+    """データ到着で哨戒する。行が増えた店舗だけを見直し、定時には全店舗を哨戒する。
+    同じシグナルは状態の last_alert で二度送らない。哨戒に失敗した店舗は、成功するまで次の周期で見直す"""
+    versions, pending = {}, set()
+    last_sig, next_full = db_signature(), 0
+    while True:
+        target = None
+        try:
+            full = time.monotonic() >= next_full
+            # 見直し待ちの店舗があれば、データ到着を待たずに取り直す
+            if not full and not pending:
+                sig = await wait_for_data(last_sig, next_full)
+                if sig is None: full = True
+                else:
+                    last_sig = sig
+                    print(f"\n[{datetime.now().strftime('%H:%M:%S')}] 📥 データ更新を検知しました。")
+            if not os.path.exists(LOCAL_DATABASE):
+                next_full = time.monotonic() + SCAN_INTERVAL_SEC; continue
+            current = store_versions()
+            target = None if full else {s for s, v in current.items() if versions.get(s) != v} | pending
+            if target is not None and not target:
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] 行の増えた店舗なし。待機。"); continue
+            veteran_brain = load_veteran_brain(doc)
+            alerts = await run_hybrid_scan(veteran_brain, doc, stores=target)
+            send_hybrid_alert(alerts)
+            mark_alerts_sent(alerts)
+            versions, pending = current, set()
+            if full: next_full = time.monotonic() + SCAN_INTERVAL_SEC
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] 哨戒完了（{'全店舗' if full else f'{len(target)} 店舗'} / 新規通知 {len(alerts)} 件）。待機。")
+        except Exception as e:
+            # 対象が決まる前や全店舗哨戒での失敗は全店舗を、店舗を絞った哨戒ならその店舗を取り直す
+            if target is None: next_full = 0
+            else: pending |= target
+            print(f"ERROR: {e}"); await asyncio.sleep(60)
+
 async def main():
     print(f"--- Sentinel Hybrid Overlord v3.2 起動 ---")
     creds = ServiceAccountCredentials.from_json_keyfile_name(JSON_KEY_FILE, ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive'])
     gc = gspread.authorize(creds); doc = gc.open_by_key(SPREADSHEET_KEY)
+    if EVENT_DRIVEN:
+        await watch_loop(doc); return
     
     while True:
         try:
@@ -209,6 +481,7 @@ async def main():
             alerts = await run_hybrid_scan(veteran_brain, doc)
             # 3. 通知
             send_hybrid_alert(alerts)
+            mark_alerts_sent(alerts)
             
             print(f"[{datetime.now().strftime('%H:%M:%S')}] 哨戒周期完了。待機。")
             await asyncio.sleep(SCAN_INTERVAL_SEC)
@@ -216,4 +489,11 @@ async def main():
             print(f"ERROR: {e}"); await asyncio.sleep(60)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if "--backtest" in sys.argv:
+        creds = ServiceAccountCredentials.from_json_keyfile_name(JSON_KEY_FILE, ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive'])
+        doc = gspread.authorize(creds).open_by_key(SPREADSHEET_KEY)
+        summary, _events = run_backtest(load_veteran_brain(doc))
+        for row in summary: print("  ", " / ".join(str(v) for v in row))
+        deliver_backtest(doc, summary)
+    else:
+        asyncio.run(main())
\ No newline at end of file
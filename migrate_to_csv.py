@@ -1,9 +1,13 @@
-# --- VERSION: migrate_to_csv.py_v1.0_20260130 ---
+# --- VERSION: migrate_to_csv.py_v1.1_20260214 ---
 
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 import csv
 import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from minrepo_store import refresh_store
 
 # ==========================================
 # BLOCK: 1. 設定エリア
@@ -13,8 +17,89 @@ RAW_DATA_SHEET  = "生データ"
 # Mac内に保存するファイル名
 LOCAL_FILE      = "minrepo_database.csv"
 
+# 分割取得の設定（1リクエストあたりの行数と、同時に取りに行く範囲の数）
+CHUNK_ROWS      = 20000
+FETCH_WORKERS   = 2
+RAW_COLS        = 6  # 日付, 店舗, 機種, 台番, 差枚, G数
+MAX_RETRY       = 5
+# 書きかけのCSVと、どこまで書いたかの記録
+PART_FILE       = LOCAL_FILE + ".part"
+CHECKPOINT_FILE = LOCAL_FILE + ".ckpt.json"
+
 # ==========================================
-# BLOCK: 2. 引越し実行エンジン
+# BLOCK: 2. 分割取得エンジン
+# ==========================================
+def col_letter(n):
+    s = ""
+    while n > 0:
+        n, r = divmod(n - 1, 26)
+        s = chr(65 + r) + s
+    return s
+
+def fetch_chunk(ws, start, end):
+    """start〜end行目を取得。混雑(429)や通信断は待ってから取り直す"""
+    rng = f"A{start}:{col_letter(RAW_COLS)}{end}"
+    for attempt in range(MAX_RETRY):
+        try:
+            return [list(r) for r in ws.get(rng)]
+        except Exception as e:
+            if attempt == MAX_RETRY - 1: raise
+            wait = 2 ** attempt * 5
+            print(f"   ⚠️ {rng} の取得に失敗（{e}）。{wait}秒後に再試行します...")
+            time.sleep(wait)
+
+def load_checkpoint(sheet_id):
+    """前回の続きがあれば (次の開始行, 書き込み済みバイト数, 行数, 保留中の空行) を返す"""
+    if not (os.path.exists(CHECKPOINT_FILE) and os.path.exists(PART_FILE)): return None
+    try:
+        with open(CHECKPOINT_FILE, encoding='utf-8') as f: ck = json.load(f)
+    except (OSError, ValueError): return None
+    if ck.get("sheet") != sheet_id or ck.get("chunk_rows") != CHUNK_ROWS: return None
+    if os.path.getsize(PART_FILE) < ck["bytes"]: return None
+    return ck
+
+def save_checkpoint(sheet_id, next_row, n_bytes, n_rows, pending):
+    tmp = CHECKPOINT_FILE + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({"sheet": sheet_id, "chunk_rows": CHUNK_ROWS, "next_row": next_row,
+                   "bytes": n_bytes, "rows": n_rows, "pending": pending}, f)
+    os.replace(tmp, CHECKPOINT_FILE)
+
+def export_sheet(ws, sheet_id, workers=FETCH_WORKERS):
+    """シートを CHUNK_ROWS 行ずつ取得して PART_FILE へ追記し、1チャンクごとに進捗を記録する"""
+    last_row = ws.row_count
+    ck = load_checkpoint(sheet_id)
+    if ck:
+        next_row, n_rows, pending = ck["next_row"], ck["rows"], ck["pending"]
+        # 記録より後ろに書きかけた分は捨てて、最後に完了したチャンクの直後から再開
+        with open(PART_FILE, 'r+b') as f: f.truncate(ck["bytes"])
+        print(f"   ↪️ 前回の続き（{next_row}行目）から再開します（書き込み済み: {n_rows} 行）")
+    else:
+        next_row, n_rows, pending = 1, 0, 0
+        open(PART_FILE, 'w').close()
+
+    starts = list(range(next_row, last_row + 1, CHUNK_ROWS))
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool, \
+         open(PART_FILE, 'a', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        for i in range(0, len(starts), max(1, workers)):
+            wave = [(s, min(s + CHUNK_ROWS - 1, last_row)) for s in starts[i:i + max(1, workers)]]
+            results = list(pool.map(lambda r: fetch_chunk(ws, *r), wave))
+            for (s, e), rows in zip(wave, results):
+                if rows:
+                    # 前のチャンク末尾で省略された空行は、後ろにデータが続くときだけ書き戻す
+                    if pending: writer.writerows([[""] * RAW_COLS] * pending)
+                    writer.writerows(r + [""] * (RAW_COLS - len(r)) for r in rows)
+                    n_rows += pending + len(rows)
+                    pending = 0
+                pending += (e - s + 1) - len(rows)
+                f.flush(); os.fsync(f.fileno())
+                save_checkpoint(sheet_id, e + 1, f.tell(), n_rows, pending)
+                print(f"   ... {e}/{last_row} 行目まで取得（書き込み済み: {n_rows} 行）")
+    return n_rows
+
+# ==========================================
+# BLOCK: 3. 引越し実行エンジン
 # ==========================================
 def run_migration():
     print("\n--- [ データの引越し（スプレッドシート → CSV）を開始 ] ---")
@@ -28,19 +113,22 @@ def run_migration():
         doc = gc.open_by_key(SPREADSHEET_KEY)
         raw_ws = doc.worksheet(RAW_DATA_SHEET)
         
-        print(f"1. スプレッドシートから '{RAW_DATA_SHEET}' を読み込んでいます...")
-        print("(27万行ある場合、2〜3分かかることがありますが、じっと待ってください)")
+        print(f"1. スプレッドシートから '{RAW_DATA_SHEET}' を {CHUNK_ROWS} 行ずつ読み込んでいます...")
+        print("(途中で止まっても、次回は最後に完了した範囲の続きから再開します)")
         
-        # 全データを取得
-        all_data = raw_ws.get_all_values()
+        # 分割取得しながら書きかけファイルへ追記
+        total = export_sheet(raw_ws, f"{SPREADSHEET_KEY}/{raw_ws.id}")
         
-        print(f"2. 読み込み完了（合計: {len(all_data)} 行）")
+        print(f"2. 読み込み完了（合計: {total} 行）")
         
-        # CSVファイルに書き出す
-        print(f"3. Macのローカルファイル '{LOCAL_FILE}' へ書き込んでいます...")
-        with open(LOCAL_FILE, mode='w', encoding='utf-8-sig', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerows(all_data)
+        # 解析エンジンが書きかけのCSVを読まないよう、完成してから差し替える
+        print(f"3. Macのローカルファイル '{LOCAL_FILE}' へ差し替えています...")
+        os.replace(PART_FILE, LOCAL_FILE)
+        os.remove(CHECKPOINT_FILE)
+
+        # 列形式データベースを発行（各エンジンは次回のロード時に新版へ切り替わる）
+        print(f"4. 列形式データベースを更新しています...")
+        refresh_store(LOCAL_FILE)
             
         print(f"\n【成功】引越しが完了しました！")
         print(f"これからは、Mac内の '{LOCAL_FILE}' を使って超高速分析が可能になります。")
@@ -49,4 +137,4 @@ def run_migration():
         print(f"【エラー】引越し中にトラブルが発生しました: {e}")
 
 if __name__ == "__main__":
-    run_migration()
\ No newline at end of file
+    run_migration()
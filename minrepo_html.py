@@ -0,0 +1,143 @@
+# --- VERSION: minrepo_html.py_v1.0_20261018 ---
+
+import os
+import re
+import sys
+import time
+import html as html_lib
+from concurrent.futures import ProcessPoolExecutor
+
+# ==========================================
+# BLOCK: 1. 設定エリア
+# ==========================================
+# 収集時に保存したページHTMLの置き場（店舗名のフォルダ / 日付_記事番号.html）
+SPOOL_DIR     = "html_spool"
+PARSE_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+# ==========================================
+# BLOCK: 2. 道具箱
+# ==========================================
+def clean_number(text):
+    if not text or text == "-" or text == " " or text == "±0": return 0
+    normalized = text.replace('▲', '-').replace('－', '-').replace(',', '').strip()
+    match = re.search(r'(-?\d+)', normalized)
+    return int(match.group(1)) if match else 0
+
+def store_name_from_title(full_title):
+    name = full_title.split('|')[0].strip()
+    return re.sub(r'(\d{4}/)?\d{1,2}/\d{1,2}\(.\)', '', name).strip()
+
+def spool_path(store_name, date, url):
+    post_id = re.search(r'/(\d+)/?(\?|$)', url)
+    fname = f"{date.replace('/', '')}_{post_id.group(1) if post_id else 'page'}.html"
+    return os.path.join(SPOOL_DIR, store_name, fname)
+
+def save_snapshot(path, html):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f: f.write(html)
+    os.replace(tmp, path)
+
+def snapshot_meta(path):
+    """スプールのパスから (日付, 期待する店名) を復元"""
+    date = os.path.basename(path)[:8]
+    return f"{date[:4]}/{date[4:6]}/{date[6:8]}", os.path.basename(os.path.dirname(path))
+
+# ==========================================
+# BLOCK: 3. オフライン解析（ページ内 evaluate と同じ抽出規則）
+# ==========================================
+# スクリプト・スタイル・コメントは表の中身ではないので先に落とす
+NOISE_RE = re.compile(r'<script\b.*?</script\s*>|<style\b.*?</style\s*>|<!--.*?-->', re.S | re.I)
+TAG_RE   = re.compile(r'<(/?)(table|tr|td|th|title)\b[^>]*>', re.I)
+INNER_RE = re.compile(r'<br\b[^>]*>|<[^>]*>', re.I)
+
+def cell_text(fragment):
+    # innerText 相当：br は改行、その他のタグは消して空白を詰める
+    text = INNER_RE.sub(lambda m: "\n" if m.group(0)[:3].lower() == "<br" else "", fragment)
+    return " ".join(html_lib.unescape(text).split())
+
+def scan_tables(html):
+    """(タイトル, [tr ごとの td 文字列リスト]) を返す。閉じタグ省略にも耐える"""
+    html = NOISE_RE.sub("", html)
+    title, rows, row, cell_at, depth, title_at = "", [], None, None, 0, None
+    for m in TAG_RE.finditer(html):
+        closing, tag = m.group(1), m.group(2).lower()
+        if tag == "title":
+            if closing and title_at is not None: title = html_lib.unescape(html[title_at:m.start()])
+            elif not closing: title_at = m.end()
+            continue
+        if not depth and tag != "table": continue
+        # 次のタグが来た時点で開いている td を閉じる
+        if cell_at is not None and row is not None:
+            row.append(cell_text(html[cell_at:m.start()]))
+        cell_at = None
+        if tag == "td" and not closing: cell_at = m.end()
+        elif tag == "tr" or (tag == "table" and closing):
+            if row is not None: rows.append(row)
+            row = [] if (tag == "tr" and not closing) else None
+        if tag == "table": depth += -1 if closing else 1
+    if row is not None: rows.append(row)
+    return title, rows
+
+def parse_day_html(html, expected_name):
+    """scrape_day_data と同じ (data, 店名) を返す。店名不一致なら (None, None)"""
+    title, rows = scan_tables(html)
+    full_title = " ".join(title.split())
+    if expected_name not in full_title: return None, None
+    data = []
+    for cols in rows:
+        # 少なくとも3列（機種、台番、差枚）あればデータとして認める
+        if len(cols) < 3: continue
+        name = cols[0]
+        if name and "機種" not in name and "平均" not in name:
+            data.append({"name": name, "num": cols[1], "diff": cols[2],
+                         "games": cols[3] if len(cols) > 3 else "0"})
+    return data, store_name_from_title(full_title)
+
+def parse_snapshot(path):
+    """スプールの1ファイルを (日付, 行リスト, 店名) へ。行は生データと同じ並び"""
+    date, expected_name = snapshot_meta(path)
+    with open(path, encoding='utf-8') as f:
+        data, real_name = parse_day_html(f.read(), expected_name)
+    if not data: return date, None, None
+    rows = [[date, real_name, r['name'], r['num'], clean_number(r['diff']), clean_number(r['games'])] for r in data]
+    return date, rows, real_name
+
+def parse_spool(paths, workers=PARSE_WORKERS):
+    """複数スナップショットをプロセスプールで解析（結果は paths の順）"""
+    if workers <= 1: return [parse_snapshot(p) for p in paths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(parse_snapshot, paths, chunksize=8))
+
+def list_spool(spool_dir=SPOOL_DIR):
+    return sorted(os.path.join(d, f) for d, _, files in os.walk(spool_dir) for f in files if f.endswith(".html"))
+
+# ==========================================
+# BLOCK: 4. 実行（再解析 / 速度計測）
+# ==========================================
+def bench(html_path, expected_name=None, repeat=50):
+    with open(html_path, encoding='utf-8') as f: html = f.read()
+    if expected_name is None:
+        expected_name = store_name_from_title(re.search(r'<title>(.*?)</title>', html, re.S).group(1))
+    t0 = time.perf_counter()
+    for _ in range(repeat): data, _name = parse_day_html(html, expected_name)
+    dt = (time.perf_counter() - t0) / repeat
+    print(f"[計測] {html_path}: {len(data)} 行 / 1ページ {dt * 1000:.1f} ms（{len(html) / dt / 1e6:.1f} MB/s, {len(data) / dt:,.0f} 行/秒）")
+
+def reparse(spool_dir, out_csv):
+    import csv
+    paths = list_spool(spool_dir)
+    results = parse_spool(paths)
+    n = 0
+    with open(out_csv, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["日付", "店舗名", "機種名", "台番号", "差枚", "G数"])
+        for _date, rows, _name in results:
+            if rows: writer.writerows(rows); n += len(rows)
+    print(f"[再解析] {len(paths)} ページ → {n} 行を {out_csv} へ書き出しました")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        bench(sys.argv[2] if len(sys.argv) > 2 else "bot_view.html")
+    else:
+        reparse(sys.argv[1] if len(sys.argv) > 1 else SPOOL_DIR, sys.argv[2] if len(sys.argv) > 2 else "reparsed_rows.csv")
@@ -0,0 +1,697 @@
+# --- VERSION: minrepo_store.py_v2.3_20261018 ---
+
+import csv
+import collections
+import fcntl
+import hashlib
+import io
+import json
+import mmap
+import os
+import re
+import time
+import uuid
+from datetime import datetime
+
+import numpy as np
+
+# ==========================================
+# BLOCK: 1. 設定エリア
+# ==========================================
+# CSVと同じ場所に「.mrcol」という列形式の高速ファイルを作る
+STORE_EXT    = ".mrcol"
+STORE_MAGIC  = b"MRCOL006"
+ALIGN        = 64
+# 列定義（日付は date.toordinal() の日番号、店舗・機種は辞書番号）
+COLUMNS      = ("day", "store", "model", "unit", "diff", "games")
+# 二次索引: (店舗, 機種) と (店舗, 日付) の複合キー → 行番号
+INDEXES      = {"sm": "model", "sd": "day"}
+KEY_MAX      = 2**31 - 1
+# 3/5日ルール: 5日の範囲（先頭と3日目の差が4日以内）に3日稼働した台を「生存台」とみなす
+SURVIVAL_SPAN = 4
+# 日次集計キューブの列: 稼働台数・差枚・G数 / うちG数>0の台 / うち3/5日ルールの生存台（機種×日のみ）
+CUBE_COLS    = ("units", "diff", "games", "a_units", "a_diff", "a_games", "e_units", "e_diff", "e_games")
+# 店舗×機種の目録の列: 初出の行番号・総G数・行数（どちらも生の行をそのまま数える。重複行も含む）
+CATALOG_COLS = ("first", "games", "rows")
+# 追記判定用の指紋を取るバイト数（先頭と、前回読み終えた位置の直前）
+FINGERPRINT_BYTES = 4096
+
+# CSVを新規作成するときの見出し行
+CSV_HEADER   = ["日付", "店舗名", "機種名", "台番号", "差枚", "G数"]
+# 改行なしで終わる最終行は、CSVがこの秒数更新されていなければ完結した行として取り込む
+TAIL_SETTLE_SEC = 2
+
+def store_path_for(csv_path):
+    return os.path.splitext(csv_path)[0] + STORE_EXT
+
+# ==========================================
+# BLOCK: 2. 日付変換
+# ==========================================
+_DAY_CACHE = {}
+
+def day_of(date_str):
+    """ "2025/01/02" -> 日番号。strptimeは遅いので自前で分解しキャッシュする"""
+    d = _DAY_CACHE.get(date_str)
+    if d is None:
+        y, m, dd = date_str.split('/')
+        d = datetime(int(y), int(m), int(dd)).toordinal()
+        _DAY_CACHE[date_str] = d
+    return d
+
+def day_to_str(day):
+    return datetime.fromordinal(day).strftime("%Y/%m/%d")
+
+def day_to_datetime(day):
+    return datetime.fromordinal(day)
+
+# ==========================================
+# BLOCK: 3. 機種名カタログ
+# ==========================================
+REMOVED_TAG = "[撤去]"
+
+def is_removed(raw):
+    return REMOVED_TAG in raw
+
+def strip_removed(raw):
+    return raw.replace(f"{REMOVED_TAG} ", "")
+
+def mark_removed(name):
+    return f"{REMOVED_TAG} {name}"
+
+def canonical_model(raw):
+    """照合用の正規名（スマスロ/パチスロ/[...] を除去）"""
+    return re.sub(r'スマスロ|パチスロ|\[.*?\]|^\s+|\s+$', '', raw).strip()
+
+def short_label(raw):
+    """タブ名用の短縮名（先頭4文字＋末尾の号機・冠）"""
+    m_clean = re.sub(r'スマスロ|パチスロ|\[.*?\]|^[LSP e]\s*|^\s+|\s+$', '', raw).strip()
+    short = m_clean[:4]
+    match = re.search(r'([0-9]+|V|ZERO|覚醒|編|祭)$', m_clean)
+    if match: short += match.group(1)
+    return short
+
+class ModelCatalog:
+    """生の機種名ごとに整数IDと正規名・短縮名・撤去フラグを1度だけ計算して持つ。
+    行の絞り込みは正規表現ではなくIDの比較で行う"""
+    def __init__(self, raws=(), known=None):
+        self.raw, self.canon, self.short, self.removed = [], [], [], []
+        self._ids, self._by_canon = {}, collections.defaultdict(list)
+        for r in raws: self.id_of(r, known)
+
+    def id_of(self, raw, known=None):
+        mid = self._ids.get(raw)
+        if mid is None:
+            mid = self._ids[raw] = len(self.raw)
+            k = known._ids.get(raw) if known is not None else None
+            if k is not None: canon, short, removed = known.canon[k], known.short[k], known.removed[k]
+            else: canon, short, removed = canonical_model(raw), short_label(raw), is_removed(raw)
+            self.raw.append(raw); self.canon.append(canon); self.short.append(short); self.removed.append(removed)
+            self._by_canon[canon].append(mid)
+        return mid
+
+    def ids_for(self, name):
+        """指定機種と同じ正規名を持つ全ID（撤去表記や冠の揺れを吸収）"""
+        return list(self._by_canon.get(canonical_model(name), []))
+
+    def matches(self, mid, names, exact=True):
+        """exact: [撤去] を外した名前の完全一致 / それ以外: 部分一致"""
+        raw = self.raw[mid]
+        return strip_removed(raw) in names if exact else any(n in raw for n in names)
+
+    def ids_matching(self, names, exact=True):
+        names = list(names)
+        return {i for i in range(len(self.raw)) if self.matches(i, names, exact)}
+
+    def to_header(self):
+        return {"canon": self.canon, "short": self.short, "removed": self.removed}
+
+    @classmethod
+    def from_header(cls, models, meta):
+        cat = cls()
+        cat.raw, cat.canon, cat.short, cat.removed = list(models), meta["canon"], meta["short"], meta["removed"]
+        cat._ids = {r: i for i, r in enumerate(cat.raw)}
+        for i, c in enumerate(cat.canon): cat._by_canon[c].append(i)
+        return cat
+
+# ==========================================
+# BLOCK: 4. CSV → 列形式 変換エンジン
+# ==========================================
+def iter_csv_rows(csv_path, store=None, model=None):
+    """CSVを1行ずつ流し読みする。店舗・機種（部分一致）で先に絞ってから数値化するので、
+    メモリ使用量はファイルの大きさに依存しない"""
+    with open(csv_path, mode='r', encoding='utf-8-sig', newline='') as f:
+        for row in csv.reader(f):
+            if len(row) != 6: continue
+            d_date, d_store, d_model, d_unit, d_diff, d_games = [c.strip() for c in row]
+            if store is not None and store not in d_store: continue
+            if model is not None and model not in d_model: continue
+            try: yield d_date, d_store, d_model, d_unit, int(d_diff), int(d_games)
+            except ValueError: continue
+
+def _complete_row(tail):
+    """改行の無い末尾の断片が、6列そろって数値化できる1行か（手書きや改行なしで終わるCSVの最終行）"""
+    try:
+        rows = list(csv.reader(io.StringIO(tail.decode('utf-8-sig'))))
+        if len(rows) != 1 or len(rows[0]) != 6: return False
+        d_date, _s, _m, d_unit, d_diff, d_games = [c.strip() for c in rows[0]]
+        day_of(d_date); int(d_unit); int(d_diff); int(d_games)
+        return True
+    except Exception: return False
+
+def _tail_ready(tail, mtime_ns):
+    """末尾の断片を行として取り込んでよいか（1行として読めて、しばらく書き足されていない）"""
+    return _complete_row(tail) and time.time_ns() - mtime_ns >= TAIL_SETTLE_SEC * 10**9
+
+def parse_csv(csv_path, start=0, stores=None, models=None):
+    """start バイト目から末尾の完結した行までを読む。戻り値の end が次回の読み始め位置、
+    seen は実際に読んだ範囲のCSVの状態（大きさ＝読んだ末尾、更新時刻＝読む前に取った値）"""
+    store_ids = {s: i for i, s in enumerate(stores or [])}
+    model_ids = {m: i for i, m in enumerate(models or [])}
+    cols = {c: [] for c in COLUMNS}
+    with open(csv_path, 'rb') as f:
+        # 更新時刻は読む前に取る（読んでいる間の追記は時刻の違いで次回に気づける）
+        mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+        f.seek(start); chunk = f.read()
+    seen = {"size": start + len(chunk), "mtime_ns": mtime_ns}
+    # 書き込み途中の最終行は次回に回す（改行なしで終わった完結行は取り込む）
+    end = start + chunk.rfind(b"\n") + 1
+    if end < seen["size"] and _tail_ready(chunk[end - start:], mtime_ns): end = seen["size"]
+    text = chunk[:end - start].decode('utf-8-sig' if start == 0 else 'utf-8')
+    for row in csv.reader(io.StringIO(text)):
+        if len(row) != 6: continue
+        try:
+            d_date, d_store, d_model, d_unit, d_diff, d_games = [c.strip() for c in row]
+            vals = (day_of(d_date), int(d_unit), int(d_diff), int(d_games))
+        except: continue
+        cols['day'].append(vals[0])
+        cols['store'].append(store_ids.setdefault(d_store, len(store_ids)))
+        cols['model'].append(model_ids.setdefault(d_model, len(model_ids)))
+        cols['unit'].append(vals[1]); cols['diff'].append(vals[2]); cols['games'].append(vals[3])
+    arrays = {c: np.asarray(v, dtype='<i4') for c, v in cols.items()}
+    return arrays, list(store_ids), list(model_ids), end, seen
+
+def append_csv_rows(csv_path, rows):
+    """rows をまとめて1回の write でCSV末尾へ追記する。読む側は最後の改行までしか読まないので、
+    書きかけの状態は見えない。改行なしで終わる最終行は行として残して改行を補い、
+    読めない断片（前回の書き込みが途中で切れた分）だけを捨ててから書く"""
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    data = buf.getvalue().encode('utf-8')
+    fd = os.open(csv_path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        size = os.fstat(fd).st_size
+        if size and os.pread(fd, 1, size - 1) != b"\n":
+            tail = os.pread(fd, min(size, 1 << 20), max(0, size - (1 << 20)))
+            tail = tail[tail.rfind(b"\n") + 1:]
+            if _complete_row(tail): data = b"\n" + data
+            else:
+                size -= len(tail)
+                os.ftruncate(fd, size)
+        if size == 0:
+            head = io.StringIO(); csv.writer(head).writerow(CSV_HEADER)
+            data = b"\xef\xbb\xbf" + head.getvalue().encode('utf-8') + data
+        os.write(fd, data)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return len(rows)
+
+def _index_keys(arrays, second):
+    return (arrays['store'].astype(np.int64) << 32) | arrays[second].astype(np.int64)
+
+def build_indexes(arrays):
+    out = {}
+    for name, second in INDEXES.items():
+        keys = _index_keys(arrays, second)
+        order = np.argsort(keys, kind='stable')
+        out[f"{name}_key"], out[f"{name}_row"] = keys[order], order.astype('<i4')
+    return out
+
+def extend_indexes(store, new):
+    """既存の索引へ追記行だけをマージする。追記行の行番号は既存より大きいので、同一キー内の行順も保たれる"""
+    out = {}
+    for name, second in INDEXES.items():
+        keys = _index_keys(new, second)
+        order = np.argsort(keys, kind='stable')
+        old_keys, keys = getattr(store, f"{name}_key"), keys[order]
+        pos = np.searchsorted(old_keys, keys, side='right')
+        out[f"{name}_key"] = np.insert(old_keys, pos, keys)
+        out[f"{name}_row"] = np.insert(getattr(store, f"{name}_row"), pos, (order + store.n_rows).astype('<i4'))
+    return out
+
+def _eligibility(s, m, u, d):
+    """(店舗, 機種, 台) ごとに3/5日ルールを初めて満たした日（3日目の日番号）を求める。
+    戻り値は (店舗<<32|機種, 台番号, 判定日) を (キー, 台番号) 順に並べたもの。満たさない台は載らない"""
+    order = np.lexsort((d, u, m, s))
+    s, m, u, d = s[order], m[order], u[order], d[order]
+    # 同じ日の重複行は1日として数える
+    keep = np.ones(len(d), dtype=bool)
+    keep[1:] = (s[1:] != s[:-1]) | (m[1:] != m[:-1]) | (u[1:] != u[:-1]) | (d[1:] != d[:-1])
+    s, m, u, d = s[keep], m[keep], u[keep], d[keep]
+    hit = np.nonzero((s[2:] == s[:-2]) & (m[2:] == m[:-2]) & (u[2:] == u[:-2]) & (d[2:] - d[:-2] <= SURVIVAL_SPAN))[0]
+    key = (s[hit].astype(np.int64) << 32) | m[hit].astype(np.int64)
+    unit, since = u[hit], d[hit + 2]
+    # 日付順に並んでいるので、台ごとの最初のヒットが最も早い判定日
+    first = np.ones(len(hit), dtype=bool)
+    first[1:] = (key[1:] != key[:-1]) | (unit[1:] != unit[:-1])
+    return {"el_key": key[first], "el_unit": unit[first].astype('<i4'), "el_from": since[first].astype('<i4')}
+
+def build_eligibility(arrays):
+    return _eligibility(arrays['store'], arrays['model'], arrays['unit'], arrays['day'])
+
+def extend_eligibility(store, arrays):
+    """追記行に出てきた台だけを判定し直す。ルールは一度満たせば外れない（単調）ので、
+    既に満たしていて追記日がすべて判定日以降の台は、判定日も変わらず見直し不要"""
+    n0 = store.n_rows
+    el_key, el_unit, el_from = store.el_key, store.el_unit, store.el_from
+    new_keys = _index_keys({c: arrays[c][n0:] for c in ('store', 'model')}, 'model')
+    first_new = {}
+    for k, u, d in zip(new_keys.tolist(), arrays['unit'][n0:].tolist(), arrays['day'][n0:].tolist()):
+        if first_new.get((k, u), KEY_MAX) > d: first_new[(k, u)] = d
+    by_key = collections.defaultdict(list)
+    for (k, u), d in first_new.items(): by_key[k].append((u, d))
+
+    redo = {}
+    for k, uds in by_key.items():
+        a, b = np.searchsorted(el_key, k, side='left'), np.searchsorted(el_key, k, side='right')
+        known = dict(zip(el_unit[a:b].tolist(), el_from[a:b].tolist()))
+        units = [u for u, d in uds if known.get(u, KEY_MAX) > d]
+        if units: redo[k] = (a, b, units)
+    if not redo: return {"el_key": el_key, "el_unit": el_unit, "el_from": el_from}
+
+    # 見直す台の全履歴を (店舗, 機種) 索引から集めて判定し、旧表の該当分と差し替える
+    rows, drop = [], np.zeros(len(el_key), dtype=bool)
+    for k, (a, b, units) in redo.items():
+        lo, hi = np.searchsorted(arrays['sm_key'], k, side='left'), np.searchsorted(arrays['sm_key'], k, side='right')
+        r = arrays['sm_row'][lo:hi]
+        rows.append(r[np.isin(arrays['unit'][r], units)])
+        drop[a:b] = np.isin(el_unit[a:b], units)
+    rows = np.concatenate(rows)
+    new = _eligibility(arrays['store'][rows], arrays['model'][rows], arrays['unit'][rows], arrays['day'][rows])
+    key = np.concatenate([el_key[~drop], new["el_key"]])
+    unit = np.concatenate([el_unit[~drop], new["el_unit"]])
+    since = np.concatenate([el_from[~drop], new["el_from"]])
+    order = np.lexsort((unit, key))
+    return {"el_key": key[order], "el_unit": unit[order], "el_from": since[order]}
+
+def _pair_member(qk, qu, tk, tu):
+    """(qk, qu) の各組が表 (tk, tu) に載っているか"""
+    k, u = np.concatenate([tk, qk]), np.concatenate([tu, qu])
+    tag = np.concatenate([np.zeros(len(tk), dtype=np.int8), np.ones(len(qk), dtype=np.int8)])
+    order = np.lexsort((tag, u, k))
+    ks, us, ts = k[order], u[order], tag[order]
+    start = np.ones(len(ks), dtype=bool)
+    start[1:] = (ks[1:] != ks[:-1]) | (us[1:] != us[:-1])
+    # 同じ組の中では表側が先に並ぶので、組の先頭が表なら載っている
+    found = (ts[start] == 0)[np.cumsum(start) - 1]
+    out = np.empty(len(k), dtype=bool); out[order] = found
+    return out[len(tk):]
+
+def _group_sum(keys, cols):
+    """keys（並べ済みの複数キー）が変わる位置で区切って cols を合計する"""
+    change = np.zeros(len(keys[0]), dtype=bool); change[0] = True
+    for k in keys: change[1:] |= k[1:] != k[:-1]
+    at = np.nonzero(change)[0]
+    return [k[at] for k in keys], {c: np.add.reduceat(v, at) if len(at) else v[:0] for c, v in cols.items()}
+
+def _cube(arrays, rows, el):
+    """rows（対象となる (店舗,日)・(店舗,機種,日) の全行）から日次集計を作る。
+    同じ台・同じ日の重複行は後の行だけを数える（unit_history と同じ扱い）"""
+    rows = np.asarray(rows, dtype=np.int64)
+    s, m, u, d = (arrays[c][rows].astype(np.int64) for c in ('store', 'model', 'unit', 'day'))
+    order = np.lexsort((rows, d, u, m, s))
+    s, m, u, d, rows = s[order], m[order], u[order], d[order], rows[order]
+    last = np.ones(len(rows), dtype=bool)
+    last[:-1] = (s[1:] != s[:-1]) | (m[1:] != m[:-1]) | (u[1:] != u[:-1]) | (d[1:] != d[:-1])
+    s, m, u, d, rows = s[last], m[last], u[last], d[last], rows[last]
+    df, g = arrays['diff'][rows].astype(np.int64), arrays['games'][rows].astype(np.int64)
+    act = (g > 0).astype(np.int64)
+    elig = _pair_member((s << 32) | m, u, el["el_key"], el["el_unit"]).astype(np.int64)
+    cols = {"units": np.ones(len(rows), dtype=np.int64), "diff": df, "games": g,
+            "a_units": act, "a_diff": df * act, "a_games": g * act,
+            "e_units": elig, "e_diff": df * elig, "e_games": g * elig}
+    o = np.lexsort((d, m, s))
+    (ms_, mm, md), model_day = _group_sum([s[o], m[o], d[o]], {c: v[o] for c, v in cols.items()})
+    o = np.lexsort((d, s))
+    (ss, sd), store_day = _group_sum([s[o], d[o]], {c: cols[c][o] for c in CUBE_COLS[:6]})
+    out = {"cm_key": (ms_ << 32) | mm, "cm_day": md.astype('<i4'), "cs_key": (ss << 32) | sd}
+    out.update({f"cm_{c}": v for c, v in model_day.items()})
+    out.update({f"cs_{c}": v for c, v in store_day.items()})
+    return out
+
+def build_cube(arrays):
+    return _cube(arrays, np.arange(len(arrays['day'])), arrays)
+
+def extend_cube(store, arrays):
+    """追記で変わる (店舗,日) と (店舗,機種,日) だけを集計し直して差し替える。
+    新たに3/5日ルールを満たした台は、過去の全稼働日の生存台集計にも効くのでその日々も対象にする"""
+    n0 = store.n_rows
+    new = {c: arrays[c][n0:] for c in ('store', 'model', 'unit', 'day')}
+    sm_new = _index_keys(new, 'model')
+    was = _pair_member(sm_new, new['unit'], store.el_key, store.el_unit)
+    now = _pair_member(sm_new, new['unit'], arrays['el_key'], arrays['el_unit'])
+    days_for = collections.defaultdict(set)
+    for k, d in zip(sm_new.tolist(), new['day'].tolist()): days_for[k].add(d)
+    for k, u in set(zip(sm_new[now & ~was].tolist(), new['unit'][now & ~was].tolist())):
+        lo, hi = np.searchsorted(arrays['sm_key'], k, side='left'), np.searchsorted(arrays['sm_key'], k, side='right')
+        r = arrays['sm_row'][lo:hi]
+        days_for[k].update(arrays['day'][r[arrays['unit'][r] == u]].tolist())
+
+    # 機種×日: 対象 (店舗,機種) の行のうち対象日のもの / 店舗×日: 対象 (店舗,日) の行
+    cm_rows, cs_keys = [], set()
+    for k, days in days_for.items():
+        lo, hi = np.searchsorted(arrays['sm_key'], k, side='left'), np.searchsorted(arrays['sm_key'], k, side='right')
+        r = arrays['sm_row'][lo:hi]
+        cm_rows.append(r[np.isin(arrays['day'][r], list(days))])
+        cs_keys.update(((k >> 32) << 32) | d for d in days)
+    cs_rows = []
+    for k in cs_keys:
+        lo, hi = np.searchsorted(arrays['sd_key'], k, side='left'), np.searchsorted(arrays['sd_key'], k, side='right')
+        cs_rows.append(arrays['sd_row'][lo:hi])
+    part_m = _cube(arrays, np.concatenate(cm_rows), arrays)
+    part_s = _cube(arrays, np.concatenate(cs_rows), arrays)
+
+    out = {}
+    drop = _pair_member(store.cm_key, store.cm_day, part_m["cm_key"], part_m["cm_day"])
+    key = np.concatenate([store.cm_key[~drop], part_m["cm_key"]])
+    day = np.concatenate([store.cm_day[~drop], part_m["cm_day"]])
+    o = np.lexsort((day, key))
+    out["cm_key"], out["cm_day"] = key[o], day[o]
+    for c in CUBE_COLS:
+        out[f"cm_{c}"] = np.concatenate([getattr(store, f"cm_{c}")[~drop], part_m[f"cm_{c}"]])[o]
+    drop = np.isin(store.cs_key, part_s["cs_key"])
+    key = np.concatenate([store.cs_key[~drop], part_s["cs_key"]])
+    o = np.argsort(key, kind='stable')
+    out["cs_key"] = key[o]
+    for c in CUBE_COLS[:6]:
+        out[f"cs_{c}"] = np.concatenate([getattr(store, f"cs_{c}")[~drop], part_s[f"cs_{c}"]])[o]
+    return out
+
+def _catalog(arrays, keys):
+    """keys（並べ済みの (店舗,機種) キー）ごとに、(店舗,機種) 索引の生の行から目録の行を作る"""
+    lo, hi = np.searchsorted(arrays['sm_key'], keys, side='left'), np.searchsorted(arrays['sm_key'], keys, side='right')
+    idx = np.concatenate([np.arange(a, b) for a, b in zip(lo.tolist(), hi.tolist())] + [np.empty(0, dtype=np.int64)])
+    grp = np.repeat(np.arange(len(keys)), hi - lo)
+    return {"ct_key": keys, "ct_first": arrays['sm_row'][lo].astype('<i4'),
+            "ct_games": np.bincount(grp, weights=arrays['games'][arrays['sm_row'][idx]], minlength=len(keys)).astype(np.int64),
+            "ct_rows": (hi - lo).astype(np.int64)}
+
+def build_catalog(arrays):
+    return _catalog(arrays, np.unique(arrays['sm_key']))
+
+def extend_catalog(store, arrays):
+    """追記行のある (店舗,機種) だけを集計し直して差し替える（初出の行番号は既存機種なら変わらない）"""
+    touched = np.unique(_index_keys({c: arrays[c][store.n_rows:] for c in ('store', 'model')}, 'model'))
+    part = _catalog(arrays, touched)
+    keep = ~np.isin(store.ct_key, touched)
+    key = np.concatenate([store.ct_key[keep], part["ct_key"]])
+    o = np.argsort(key, kind='stable')
+    out = {"ct_key": key[o]}
+    for c in CATALOG_COLS:
+        out[f"ct_{c}"] = np.concatenate([getattr(store, f"ct_{c}")[keep], part[f"ct_{c}"]])[o]
+    return out
+
+def _pad(n):
+    return (-n) % ALIGN
+
+def write_store(out_path, arrays, stores, models, source, known_catalog=None):
+    # 機種カタログは取り込み時に計算して同梱する（既知の機種は前版の計算結果を再利用）
+    catalog = ModelCatalog(models, known=known_catalog)
+    header = {"n_rows": int(len(arrays['day'])), "source": source, "stores": stores, "models": models,
+              "model_catalog": catalog.to_header(), "columns": {}}
+    # 列の配置を先に決める（ヘッダ長に依存するので二段階）
+    body, offset = [], 0
+    for name, arr in arrays.items():
+        dtype = '<i8' if arr.dtype.itemsize == 8 else '<i4'
+        blob = np.ascontiguousarray(arr, dtype=dtype).tobytes()
+        header["columns"][name] = {"offset": offset, "length": int(len(arr)), "dtype": dtype}
+        body.append(blob + b"\0" * _pad(len(blob))); offset += len(blob) + _pad(len(blob))
+    h_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    h_bytes += b" " * _pad(len(STORE_MAGIC) + 8 + len(h_bytes))
+
+    tmp_path = f"{out_path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(STORE_MAGIC); f.write(len(h_bytes).to_bytes(8, 'little')); f.write(h_bytes)
+        for blob in body: f.write(blob)
+    # 書き込み途中のファイルを他プロセスに見せないよう、最後に一発で差し替える
+    os.replace(tmp_path, out_path)
+
+def _fingerprint(csv_path, offset):
+    """先頭と offset 直前の数KBのハッシュ。ここが変わっていればCSVは書き換えられている"""
+    with open(csv_path, 'rb') as f:
+        head = f.read(min(FINGERPRINT_BYTES, offset))
+        f.seek(max(0, offset - FINGERPRINT_BYTES)); tail = f.read(min(FINGERPRINT_BYTES, offset))
+    return hashlib.sha1(head).hexdigest() + hashlib.sha1(tail).hexdigest()
+
+def _source_stamp(csv_path, offset, seen, generation):
+    # 大きさ・時刻は解析後に stat し直さず、読んだ時点の値を記録する（解析中の追記を取りこぼさない）
+    return {"path": os.path.abspath(csv_path), "size": seen["size"], "mtime_ns": seen["mtime_ns"],
+            "offset": offset, "fingerprint": _fingerprint(csv_path, offset), "generation": generation}
+
+def build_store(csv_path, out_path=None):
+    """全件から作り直す。generation が変わるので、保持している読み手は全件を読み直す"""
+    out_path = out_path or store_path_for(csv_path)
+    arrays, stores, models, end, seen = parse_csv(csv_path)
+    arrays.update(build_indexes(arrays))
+    arrays.update(build_eligibility(arrays))
+    arrays.update(build_cube(arrays))
+    arrays.update(build_catalog(arrays))
+    write_store(out_path, arrays, stores, models, _source_stamp(csv_path, end, seen, uuid.uuid4().hex))
+    return out_path
+
+def append_store(csv_path, store, out_path=None):
+    """前回の読了位置（ウォーターマーク）以降に追記された行だけを取り込む"""
+    out_path = out_path or store.path
+    new, stores, models, end, seen = parse_csv(csv_path, start=store.source["offset"], stores=store.stores, models=store.models)
+    if not len(new['day']):
+        # 完結した新しい行が無い（書き込み途中の1行だけ等）：中身はそのまま、読了位置の記録だけ更新する
+        arrays = {name: getattr(store, name) for name in store.header["columns"]}
+    else:
+        arrays = {c: np.concatenate([getattr(store, c), new[c]]) for c in COLUMNS}
+        arrays.update(extend_indexes(store, new))
+        arrays.update(extend_eligibility(store, arrays))
+        arrays.update(extend_cube(store, arrays))
+        arrays.update(extend_catalog(store, arrays))
+    write_store(out_path, arrays, stores, models, _source_stamp(csv_path, end, seen, store.source["generation"]), known_catalog=store.catalog)
+    return len(new['day'])
+
+# ==========================================
+# BLOCK: 5. 読み込み（数ミリ秒）
+# ==========================================
+def read_header(path):
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(STORE_MAGIC)) != STORE_MAGIC: return None
+            return json.loads(f.read(int.from_bytes(f.read(8), 'little')).decode('utf-8'))
+    except (OSError, ValueError): return None
+
+class MinrepoStore:
+    """列形式ファイルを読み取り専用でメモリマップする。列は np.frombuffer によるゼロコピー参照で、
+    同じファイルを開いた全プロセスがページキャッシュ上の1つの実体を共有する"""
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            raw = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if raw[:len(STORE_MAGIC)] != STORE_MAGIC: raise ValueError(f"列形式ファイルではありません: {path}")
+        h_len = int.from_bytes(raw[len(STORE_MAGIC):len(STORE_MAGIC) + 8], 'little')
+        base = len(STORE_MAGIC) + 8
+        header = json.loads(raw[base:base + h_len].decode('utf-8'))
+        body = base + h_len
+
+        self.path, self.header = path, header
+        self.n_rows = header["n_rows"]
+        self.stores, self.models = header["stores"], header["models"]
+        self.source = header["source"]
+        self.generation = self.source["generation"]
+        self.catalog = ModelCatalog.from_header(self.models, header["model_catalog"]) if "model_catalog" in header else ModelCatalog(self.models)
+        self._labels = {}
+        for name, c in header["columns"].items():
+            setattr(self, name, np.frombuffer(raw, dtype=c["dtype"], count=c["length"], offset=body + c["offset"]))
+
+    def store_ids(self, keyword):
+        """店名キーワード（部分一致）に該当する店舗番号"""
+        return [i for i, s in enumerate(self.stores) if keyword in s]
+
+    def _lookup(self, index, sid, lo, hi):
+        """索引の二分探索で、キー (sid, lo〜hi) に該当する行番号の区間を返す"""
+        keys = getattr(self, f"{index}_key")
+        a = np.searchsorted(keys, (sid << 32) | lo, side='left')
+        b = np.searchsorted(keys, (sid << 32) | hi, side='right')
+        return getattr(self, f"{index}_row")[a:b]
+
+    @staticmethod
+    def _merge_rows(parts):
+        # 複数区間を元のCSV行順へ戻す
+        return np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype='<i4')
+
+    def rows_for_store(self, keyword, day_from=None, day_to=None):
+        """店名キーワード（部分一致）の行番号。日番号で期間を絞ると該当日の行だけを読む"""
+        lo, hi = (0 if day_from is None else day_from), (KEY_MAX if day_to is None else day_to)
+        return self._merge_rows([self._lookup("sd", sid, lo, hi) for sid in self.store_ids(keyword)])
+
+    def rows_for_model(self, keyword, model_name):
+        """店名キーワード＋機種（正規名一致）の行番号。機種判定は整数IDの比較のみ"""
+        mids = self.catalog.ids_for(model_name)
+        return self._merge_rows([self._lookup("sm", sid, m, m) for sid in self.store_ids(keyword) for m in mids])
+
+    def eligible_units(self, sid, mid):
+        """3/5日ルールを満たした台 {台番号: 判定日の日番号}（取り込み時に計算済みの表を引くだけ）"""
+        k = (sid << 32) | mid
+        a, b = np.searchsorted(self.el_key, k, side='left'), np.searchsorted(self.el_key, k, side='right')
+        return dict(zip(self.el_unit[a:b].tolist(), self.el_from[a:b].tolist()))
+
+    def store_daily(self, keyword, exact=False):
+        """店舗×日の集計（店名キーワードに該当する店舗を日ごとに合算）。exact=True なら店名完全一致の1店舗のみ。戻り値は (日番号配列, {列: 配列})"""
+        sids = ([self.stores.index(keyword)] if keyword in self.stores else []) if exact else self.store_ids(keyword)
+        idx = np.concatenate([np.arange(np.searchsorted(self.cs_key, sid << 32), np.searchsorted(self.cs_key, (sid + 1) << 32))
+                              for sid in sids] + [np.empty(0, dtype=np.int64)])
+        days, inv = np.unique(self.cs_key[idx] & 0xFFFFFFFF, return_inverse=True)
+        return days, {c: np.bincount(inv, weights=getattr(self, f"cs_{c}")[idx], minlength=len(days)).astype(np.int64) for c in CUBE_COLS[:6]}
+
+    def store_catalog(self, keyword):
+        """店名キーワードに該当する店舗の機種目録。機種ごとに合算し、行の初出順に
+        [(機種名, 総G数, 行数, 撤去フラグ)] を返す（行は読まない。G数・行数は rows_for_store の行をそのまま数えた値）"""
+        stats, first = {}, {}
+        for sid in self.store_ids(keyword):
+            a, b = np.searchsorted(self.ct_key, sid << 32), np.searchsorted(self.ct_key, (sid + 1) << 32)
+            for k, f, g, n in zip(self.ct_key[a:b].tolist(), self.ct_first[a:b].tolist(), self.ct_games[a:b].tolist(), self.ct_rows[a:b].tolist()):
+                m = k & 0xFFFFFFFF
+                cur = stats.setdefault(m, [0, 0])
+                cur[0] += g; cur[1] += n
+                first[m] = min(f, first.get(m, f))
+        return [(self.models[m], *stats[m], bool(self.catalog.removed[m])) for m in sorted(stats, key=first.get)]
+
+    def model_daily(self, sid, mid):
+        """店舗×機種×日の集計。戻り値は (日番号配列, {列: 配列})"""
+        k = (sid << 32) | mid
+        a, b = np.searchsorted(self.cm_key, k, side='left'), np.searchsorted(self.cm_key, k, side='right')
+        return self.cm_day[a:b], {c: getattr(self, f"cm_{c}")[a:b] for c in CUBE_COLS}
+
+    def day_labels(self, as_datetime=True):
+        if as_datetime not in self._labels:
+            conv = day_to_datetime if as_datetime else day_to_str
+            self._labels[as_datetime] = {d: conv(d) for d in np.unique(self.day).tolist()}
+        return self._labels[as_datetime]
+
+    def store_row_counts(self):
+        """店舗ごとの行数（店舗番号順）。索引の境目を引くだけで行は読まない"""
+        return np.diff(np.searchsorted(self.sd_key, np.arange(len(self.stores) + 1, dtype=np.int64) << 32)).tolist()
+
+    def store_rows(self, sid):
+        return self._merge_rows([self._lookup("sd", sid, 0, KEY_MAX)])
+
+    def store_models(self, sid):
+        """店舗内に出てくる機種番号（CSV上の初出順）"""
+        m = self.model[self.store_rows(sid)]
+        ids, first = np.unique(m, return_index=True)
+        return ids[np.argsort(first)].tolist()
+
+    def unit_history(self, sid, mid, as_datetime=True):
+        """1機種分の {台番号: {日付: {'diff', 'games'}}}。台・日付はCSV上の初出順、同じ台・同じ日の重複行は後の行が勝つ"""
+        rows = self._merge_rows([self._lookup("sm", sid, mid, mid)])
+        labels = self.day_labels(as_datetime)
+        units = collections.defaultdict(dict)
+        for d, u, df, g in zip(self.day[rows].tolist(), self.unit[rows].tolist(), self.diff[rows].tolist(), self.games[rows].tolist()):
+            units[u][labels[d]] = {'diff': df, 'games': g}
+        return units
+
+    def model_rows(self, sid, mid, rows=None):
+        """1機種分の (台, 日, 差枚, G数) を配列で。同じ台・同じ日の重複行は後の行だけ（unit_history と同じ扱い）。
+        rows を渡すとその行（追記分など）だけで作る"""
+        if rows is None: rows = self._lookup("sm", sid, mid, mid)
+        u, d = self.unit[rows].astype(np.int64), self.day[rows].astype(np.int64)
+        order = np.lexsort((rows, d, u))
+        last = np.ones(len(order), dtype=bool); last[:-1] = (u[order][1:] != u[order][:-1]) | (d[order][1:] != d[order][:-1])
+        keep = order[last]
+        return u[keep], d[keep], self.diff[rows][keep].astype(np.int64), self.games[rows][keep].astype(np.int64)
+
+def _is_current(header, csv_path):
+    """読了位置より後に完結した行（改行なしで終わる完結行を含む）が無く、大きさ・更新時刻も記録どおりなら最新"""
+    if not header: return False
+    src, st = header["source"], os.stat(csv_path)
+    if src["size"] != st.st_size or src["mtime_ns"] != st.st_mtime_ns: return False
+    if src["offset"] >= st.st_size: return True
+    # 読了位置の後ろは書き込み途中の1行だけか（改行が来ている・1行として読めるなら取り込み待ちの行がある）
+    with open(csv_path, 'rb') as f:
+        f.seek(src["offset"])
+        tail = f.read()
+    return b"\n" not in tail and not _complete_row(tail)
+
+def refresh_store(csv_path, store_path=None):
+    """CSVの状態を確認し、未変更なら何もしない／追記なら差分のみ／書き換え・切り詰めなら全件再構築"""
+    store_path = store_path or store_path_for(csv_path)
+    if _is_current(read_header(store_path), csv_path): return "fresh"
+    # 同時に動くプロセス同士で二重に構築しないよう、発行はロックの中で行う
+    with open(store_path + ".lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        header = read_header(store_path)
+        if _is_current(header, csv_path): return "fresh"
+        return _publish(csv_path, store_path, header)
+
+def _publish(csv_path, store_path, header):
+    st = os.stat(csv_path)
+    src = header["source"] if header else None
+    if src and "offset" in src and st.st_size >= src["offset"] and _fingerprint(csv_path, src["offset"]) == src["fingerprint"]:
+        added = append_store(csv_path, MinrepoStore(store_path), store_path)
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] 📦 列形式データベースへ追記: +{added} 行")
+        return "appended"
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] 📦 列形式データベースを再構築中... ({os.path.basename(csv_path)})")
+    build_store(csv_path, store_path)
+    return "rebuilt"
+
+_OPEN_STORES = {}
+
+def open_shared(store_path):
+    """プロセス内で1つのマップを使い回す。発行側が os.replace で差し替えたら（inodeが変わったら）開き直す"""
+    cur = _OPEN_STORES.get(store_path)
+    try: ino = os.stat(store_path).st_ino
+    except OSError: ino = None
+    if cur is None or cur.inode != ino:
+        cur = _OPEN_STORES[store_path] = MinrepoStore(store_path)
+    return cur
+
+def load_store(csv_path):
+    """CSVが更新されていれば列形式を更新し（追記分のみ）、そうでなければ共有マップをそのまま返す"""
+    store_path = store_path_for(csv_path)
+    refresh_store(csv_path, store_path)
+    return open_shared(store_path)
+
+# ==========================================
+# BLOCK: 6. 移動平均カーネル（全エンジン共通）
+# ==========================================
+def rolling_sums(series, window):
+    """series: (系列数, 日数)。各位置 i の sum(x[max(0, i-window+1):i+1]) をまとめて返す。
+    整数は累積和の差（O(n)）。小数は Python の sum と同じ「左から順に足す」順序でずらし足しするので、
+    素朴なスライス合計とビット単位で同じ値になる（floor や大小比較の境目がずれない）。
+    小数側が O(n·w) なのはこのための意図的な選択で、累積和の差（丸め誤差が出る）には置き換えないこと"""
+    x = np.asarray(series)
+    if x.ndim == 1: x = x[None, :]
+    n = x.shape[1]
+    if x.dtype.kind in "iub":
+        c = np.zeros((x.shape[0], n + 1), dtype=np.int64)
+        np.cumsum(x, axis=1, dtype=np.int64, out=c[:, 1:])
+        lo = np.maximum(np.arange(n) - window + 1, 0)
+        return c[:, 1:] - c[:, lo]
+    x = x.astype(np.float64)
+    out = np.cumsum(x, axis=1)
+    if n >= window:
+        acc = x[:, :n - window + 1].copy()
+        for k in range(1, window): acc += x[:, k:n - window + 1 + k]
+        out[:, window - 1:] = acc
+    return out
+
+def rolling_means(series, windows, fixed=False):
+    """{窓: (系列数, 日数)} を返す。fixed=False は先頭の欠けた窓を実在日数で割る（analyzer/commander 方式）、
+    fixed=True は常に窓の長さで割る（chronicler/seeker 方式）"""
+    x = np.asarray(series)
+    n = x.shape[-1]
+    res = {}
+    for w in windows:
+        div = w if fixed else np.minimum(np.arange(1, n + 1), w)
+        res[w] = rolling_sums(x, w) / div
+    return res
+
+if __name__ == "__main__":
+    import sys
+    target = sys.argv[1] if len(sys.argv) > 1 else "minrepo_database.csv"
+    print(f"【完了】{build_store(target)} を作成しました。")
@@ -0,0 +1,167 @@
+# --- VERSION: test_migrate_to_csv.py_v1.0_20260214 ---
+# migrate_to_csv.export_sheet を、Sheets API の挙動をまねた偽ワークシートで検証する
+
+import csv
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import migrate_to_csv as mig
+
+# ==========================================
+# BLOCK: 1. 偽ワークシート
+# ==========================================
+class FakeWorksheet:
+    """values.get と同じく、範囲末尾の空行と各行末尾の空セルを省いて返す"""
+    def __init__(self, rows, row_count=None, fail_on=()):
+        self.rows = rows
+        self.row_count = len(rows) if row_count is None else row_count
+        self.fail_on = set(fail_on)
+        self.requests = []
+
+    def get(self, rng):
+        self.requests.append(rng)
+        a, b = rng.split(":")
+        start, end = int(a[1:]), int(b.lstrip("ABCDEFGHIJKLMNOPQRSTUVWXYZ"))
+        if start in self.fail_on: raise ConnectionError(f"{rng} 取得失敗")
+        out = []
+        for r in self.rows[start - 1:end]:
+            r = list(r)
+            while r and r[-1] == "": r.pop()
+            out.append(r)
+        while out and not out[-1]: out.pop()
+        return out
+
+    def get_all_values(self):
+        """一括取得（v1.0 の方式）。末尾の空行を省き、各行を最大列数まで埋める"""
+        out = [list(r) for r in self.rows]
+        while out and not any(out[-1]): out.pop()
+        width = max((len(r) for r in out), default=0)
+        return [r + [""] * (width - len(r)) for r in out]
+
+def make_rows(n, blanks=(), tail_blanks=0):
+    rows = [["日付", "店舗", "機種", "台番", "差枚", "G数"]]
+    for i in range(1, n):
+        if i in blanks: rows.append([""] * mig.RAW_COLS)
+        # 差枚が空のセル（行末の空セル省略の対象）も混ぜる
+        else: rows.append([f"2026/01/{i % 28 + 1:02d}", "店A", f"機種{i % 7}", str(i), "" if i % 5 == 0 else str(i * 10 - 300), "" if i % 5 == 0 else str(i * 3)])
+    return rows + [[""] * mig.RAW_COLS] * tail_blanks
+
+def single_shot(ws, path):
+    """v1.0 と同じ一括取得での書き出し"""
+    with open(path, mode='w', encoding='utf-8-sig', newline='') as f:
+        csv.writer(f).writerows(ws.get_all_values())
+    with open(path, 'rb') as f: return f.read()
+
+def read_part():
+    with open(mig.PART_FILE, 'rb') as f: return f.read()
+
+@pytest.fixture(autouse=True)
+def sandbox(tmp_path, monkeypatch):
+    monkeypatch.setattr(mig, "PART_FILE", str(tmp_path / "db.csv.part"))
+    monkeypatch.setattr(mig, "CHECKPOINT_FILE", str(tmp_path / "db.csv.ckpt.json"))
+    monkeypatch.setattr(mig, "CHUNK_ROWS", 10)
+    monkeypatch.setattr(mig.time, "sleep", lambda s: None)
+    return tmp_path
+
+# ==========================================
+# BLOCK: 2. チャンク境界
+# ==========================================
+@pytest.mark.parametrize("n", [9, 10, 11, 19, 20, 21])
+@pytest.mark.parametrize("workers", [1, 2, 3])
+def test_chunk_boundaries(sandbox, n, workers):
+    ws = FakeWorksheet(make_rows(n))
+    assert mig.export_sheet(ws, "s/0", workers=workers) == n
+    assert read_part() == single_shot(ws, sandbox / "one.csv")
+    # 取得範囲はすき間も重なりもなく row_count まで
+    spans = sorted((int(r.split(":")[0][1:]), int(r.split(":")[1][1:])) for r in ws.requests)
+    assert spans[0][0] == 1 and spans[-1][1] == n
+    assert all(b[0] == a[1] + 1 for a, b in zip(spans, spans[1:]))
+    assert all(e - s + 1 <= mig.CHUNK_ROWS for s, e in spans)
+
+def test_matches_single_request(sandbox, monkeypatch):
+    ws = FakeWorksheet(make_rows(37, blanks={12, 13}, tail_blanks=4))
+    monkeypatch.setattr(mig, "CHUNK_ROWS", 100)
+    assert mig.export_sheet(ws, "s/0", workers=1) == 37
+    assert len(ws.requests) == 1
+    assert read_part() == single_shot(ws, sandbox / "one.csv")
+
+# ==========================================
+# BLOCK: 3. 空行の扱い
+# ==========================================
+@pytest.mark.parametrize("tail", [1, 9, 10, 11, 25])
+def test_trailing_blank_rows_trimmed(sandbox, tail):
+    ws = FakeWorksheet(make_rows(23, tail_blanks=tail))
+    assert mig.export_sheet(ws, "s/0", workers=2) == 23
+    assert read_part() == single_shot(ws, sandbox / "one.csv")
+
+def test_blank_rows_across_chunks_kept(sandbox):
+    # チャンク末尾の空行と、丸ごと空のチャンクを挟んでもデータが続くなら書き戻す
+    blanks = set(range(8, 32))
+    ws = FakeWorksheet(make_rows(45, blanks=blanks, tail_blanks=3))
+    assert mig.export_sheet(ws, "s/0", workers=2) == 45
+    assert read_part() == single_shot(ws, sandbox / "one.csv")
+
+def test_row_count_beyond_data(sandbox):
+    # シートの枠（row_count）だけが大きく、実データは手前で終わる
+    ws = FakeWorksheet(make_rows(12), row_count=57)
+    assert mig.export_sheet(ws, "s/0", workers=2) == 12
+    assert read_part() == single_shot(ws, sandbox / "one.csv")
+
+# ==========================================
+# BLOCK: 4. 中断からの再開
+# ==========================================
+@pytest.mark.parametrize("fail_at", [11, 21, 31])
+@pytest.mark.parametrize("workers", [1, 2])
+def test_resume_after_failure(sandbox, fail_at, workers):
+    rows = make_rows(38, blanks={19, 20, 21, 22}, tail_blanks=2)
+    broken = FakeWorksheet(rows, fail_on={fail_at})
+    with pytest.raises(ConnectionError):
+        mig.export_sheet(broken, "s/0", workers=workers)
+    assert broken.requests.count(f"A{fail_at}:F{fail_at + 9}") == mig.MAX_RETRY
+    # 失敗したチャンクと同じ波の分は記録されない（最初の波で失敗したら記録なし）
+    ck = mig.load_checkpoint("s/0")
+    done = ck["next_row"] if ck else 1
+    assert done == 1 + (fail_at - 1) // (10 * workers) * 10 * workers
+
+    # 記録より後ろに書きかけたゴミは捨てて再開する
+    with open(mig.PART_FILE, 'ab') as f: f.write("2026/01/01,店A,書きかけ".encode())
+    ws = FakeWorksheet(rows)
+    assert mig.export_sheet(ws, "s/0", workers=workers) == 38
+    assert min(int(r.split(":")[0][1:]) for r in ws.requests) == done
+    assert read_part() == single_shot(ws, sandbox / "one.csv")
+
+def test_transient_failure_retried(sandbox):
+    ws = FakeWorksheet(make_rows(25))
+    real_get, hits = ws.get, []
+    def flaky(rng):
+        hits.append(rng)
+        if len(hits) <= 2: raise ConnectionError("429")
+        return real_get(rng)
+    ws.get = flaky
+    assert mig.export_sheet(ws, "s/0", workers=1) == 25
+    assert read_part() == single_shot(ws, sandbox / "one.csv")
+
+def test_checkpoint_ignored_for_other_sheet_or_chunk(sandbox, monkeypatch):
+    rows = make_rows(30)
+    with pytest.raises(ConnectionError):
+        mig.export_sheet(FakeWorksheet(rows, fail_on={21}), "s/0", workers=1)
+    assert mig.load_checkpoint("s/1") is None
+    monkeypatch.setattr(mig, "CHUNK_ROWS", 7)
+    assert mig.load_checkpoint("s/0") is None
+    ws = FakeWorksheet(rows)
+    assert mig.export_sheet(ws, "s/0", workers=1) == 30
+    assert min(int(r.split(":")[0][1:]) for r in ws.requests) == 1
+    assert read_part() == single_shot(ws, sandbox / "one.csv")
+
+def test_truncated_part_file_restarts(sandbox):
+    rows = make_rows(30)
+    with pytest.raises(ConnectionError):
+        mig.export_sheet(FakeWorksheet(rows, fail_on={21}), "s/0", workers=1)
+    # 記録より短い書きかけファイルは信用せず最初から
+    with open(mig.PART_FILE, 'r+b') as f: f.truncate(5)
+    ws = FakeWorksheet(rows)
+    assert mig.export_sheet(ws, "s/0", workers=1) == 30
+    assert read_part() == single_shot(ws, sandbox / "one.csv")
@@ -0,0 +1,127 @@
+# --- VERSION: test_minrepo_html.py_v1.0_20261018 ---
+# minrepo_html の正規表現スキャナを、標準の html.parser で組んだ参照実装（ページ内 evaluate と同じ抽出規則）と比べる
+
+import os
+import sys
+from html.parser import HTMLParser
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import minrepo_html as mh
+
+SAMPLE = os.path.join(ROOT, "bot_view.html")
+
+# ==========================================
+# BLOCK: 1. 参照実装（document.querySelectorAll('table tr') → td の innerText）
+# ==========================================
+class ReferenceTables(HTMLParser):
+    """閉じタグ省略は、次の td/th/tr/table で暗黙に閉じる（ブラウザの木構築と同じ結果になる範囲で）"""
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title, self.in_title, self.skip = "", False, 0
+        self.depth, self.rows, self.row, self.cell = 0, [], None, None
+
+    def _close_cell(self):
+        if self.cell is not None and self.row is not None: self.row.append(" ".join("".join(self.cell).split()))
+        self.cell = None
+
+    def _close_row(self):
+        self._close_cell()
+        if self.row is not None: self.rows.append(self.row)
+        self.row = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"): self.skip += 1
+        elif tag == "title": self.in_title = True
+        elif tag == "table": self._close_cell(); self.depth += 1
+        elif not self.depth: return
+        elif tag == "tr": self._close_row(); self.row = []
+        elif tag in ("td", "th"):
+            self._close_cell()
+            if tag == "td": self.cell = []
+        elif tag == "br" and self.cell is not None: self.cell.append("\n")
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style"): self.skip = max(0, self.skip - 1)
+        elif tag == "title": self.in_title = False
+        elif tag == "table" and self.depth: self._close_row(); self.depth -= 1
+        elif tag == "tr": self._close_row()
+        elif tag in ("td", "th"): self._close_cell()
+
+    def handle_data(self, data):
+        if self.skip: return
+        if self.in_title: self.title += data
+        elif self.cell is not None: self.cell.append(data)
+
+def reference_parse(html, expected_name):
+    p = ReferenceTables(); p.feed(html); p.close(); p._close_row()
+    full_title = " ".join(p.title.split())
+    if expected_name not in full_title: return None, None
+    data = [{"name": c[0], "num": c[1], "diff": c[2], "games": c[3] if len(c) > 3 else "0"}
+            for c in p.rows if len(c) >= 3 and c[0] and "機種" not in c[0] and "平均" not in c[0]]
+    return data, mh.store_name_from_title(full_title)
+
+# ==========================================
+# BLOCK: 2. 保存済みページ（bot_view.html）
+# ==========================================
+@pytest.fixture(scope="module")
+def sample():
+    with open(SAMPLE, encoding='utf-8') as f: return f.read()
+
+def test_sample_matches_reference(sample):
+    data, name = mh.parse_day_html(sample, "マルハンつくば店")
+    assert (data, name) == reference_parse(sample, "マルハンつくば店")
+    assert name == "マルハンつくば店"
+    assert len(data) == 380
+
+def test_sample_known_rows(sample):
+    data, _name = mh.parse_day_html(sample, "つくば")
+    assert data[0] == {"name": "スマスロ 沖ドキ!DUO アンコール", "num": "794", "diff": "15,900", "games": "6,138"}
+    assert data[1] == {"name": "スマスロモンキーターンV", "num": "494", "diff": "10,300", "games": "8,280"}
+    assert all(r["name"] and "機種" not in r["name"] and "平均" not in r["name"] for r in data)
+
+def test_sample_store_mismatch(sample):
+    assert mh.parse_day_html(sample, "存在しない店") == (None, None)
+
+def test_snapshot_rows(sample, tmp_path):
+    path = tmp_path / "マルハンつくば店" / "20260124_12345.html"
+    path.parent.mkdir()
+    path.write_text(sample, encoding='utf-8')
+    date, rows, name = mh.parse_snapshot(str(path))
+    ref, _ = reference_parse(sample, "マルハンつくば店")
+    assert (date, name) == ("2026/01/24", "マルハンつくば店")
+    assert rows == [[date, name, r["name"], r["num"], mh.clean_number(r["diff"]), mh.clean_number(r["games"])] for r in ref]
+    assert rows[0][4:] == [15900, 6138]
+
+# ==========================================
+# BLOCK: 3. 崩れたHTML
+# ==========================================
+EDGE = """<html><head><title>1/5(月) テスト店 | 詳細</title>
+<script>var s = "<table><tr><td>偽</td><td>1</td><td>2</td></tr></table>";</script>
+<style>td { color: red }</style></head><body>
+<!-- <table><tr><td>コメント</td><td>1</td><td>2</td></tr></table> -->
+<p><td>表の外</td><td>1</td><td>2</td></p>
+<table>
+<tr><th>機種</th><th>台番</th><th>差枚</th><th>G数</th></tr>
+<tr><td>ジャグラー<br>EX</td><td>101</td><td>&#x25B2;1,200</td><td>3,000</td></tr>
+<tr><td>  北斗&amp;拳  </td><td>102<td>+500<td>4,100
+<tr><td>ハナハナ</td><td>103</td><td>-</td></tr>
+<tr><td>平均</td><td>-</td><td>100</td><td>2,000</td></tr>
+<tr><td>2列だけ</td><td>104</td></tr>
+<tr><td><span>バーサス</span></td><td><b>105</b></td><td>±0</td><td>0</td></tr>
+</table>
+</body></html>"""
+
+def test_edge_cases_match_reference():
+    data, name = mh.parse_day_html(EDGE, "テスト店")
+    assert (data, name) == reference_parse(EDGE, "テスト店")
+    assert name == "テスト店"
+    assert [r["name"] for r in data] == ["ジャグラー EX", "北斗&拳", "ハナハナ", "バーサス"]
+    assert data[1] == {"name": "北斗&拳", "num": "102", "diff": "+500", "games": "4,100"}
+    assert data[2]["games"] == "0"
+    assert mh.clean_number(data[0]["diff"]) == -1200
@@ -0,0 +1,107 @@
+# --- VERSION: test_minrepo_store.py_v1.0_20261018 ---
+# minrepo_store の CSV 追記と列形式データへの取り込みを、一時ディレクトリの小さなCSVで検証する
+
+import csv
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import minrepo_store as ms
+
+# ==========================================
+# BLOCK: 1. 道具
+# ==========================================
+ROWS = [["2026/01/01", "店A", "機種1", "1", "100", "1000"],
+        ["2026/01/01", "店A", "機種1", "2", "-50", "800"],
+        ["2026/01/02", "店A", "機種2", "3", "20", "300"]]
+
+def write_csv(path, rows, newline_at_end=True):
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        csv.writer(f).writerows([ms.CSV_HEADER] + rows)
+    if not newline_at_end:
+        with open(path, 'rb+') as f:
+            data = f.read().rstrip(b"\r\n")
+            f.seek(0); f.truncate(); f.write(data)
+
+def read_rows(path):
+    return [r for r in csv.reader(open(path, encoding='utf-8-sig', newline=''))][1:]
+
+# ==========================================
+# BLOCK: 2. 追記
+# ==========================================
+def test_append_keeps_last_row_without_newline(tmp_path):
+    path = str(tmp_path / "db.csv")
+    write_csv(path, ROWS, newline_at_end=False)
+    ms.append_csv_rows(path, [["2026/01/03", "店A", "機種1", 1, 70, 900]])
+    assert read_rows(path) == ROWS + [["2026/01/03", "店A", "機種1", "1", "70", "900"]]
+
+def test_append_drops_broken_fragment(tmp_path):
+    path = str(tmp_path / "db.csv")
+    write_csv(path, ROWS)
+    with open(path, 'ab') as f: f.write("2026/01/03,店A,機".encode())
+    ms.append_csv_rows(path, [["2026/01/03", "店A", "機種1", 1, 70, 900]])
+    assert read_rows(path) == ROWS + [["2026/01/03", "店A", "機種1", "1", "70", "900"]]
+
+def test_append_to_missing_file_writes_header(tmp_path):
+    path = str(tmp_path / "db.csv")
+    ms.append_csv_rows(path, [ROWS[0]])
+    with open(path, 'rb') as f: assert f.read().startswith(b"\xef\xbb\xbf")
+    assert read_rows(path) == [ROWS[0]]
+
+# ==========================================
+# BLOCK: 3. 改行なしで終わるCSVの取り込み
+# ==========================================
+def settle(path):
+    """書き込みが落ち着いたことにする（更新時刻を TAIL_SETTLE_SEC より前へ）"""
+    past = os.stat(path).st_mtime - ms.TAIL_SETTLE_SEC - 1
+    os.utime(path, (past, past))
+
+def stored_rows(path):
+    store = ms.MinrepoStore(ms.store_path_for(path))
+    return [[ms.day_to_str(d), store.stores[s], store.models[m], str(u), str(df), str(g)]
+            for d, s, m, u, df, g in zip(store.day.tolist(), store.store.tolist(), store.model.tolist(),
+                                         store.unit.tolist(), store.diff.tolist(), store.games.tolist())]
+
+def is_current(path):
+    return ms._is_current(ms.read_header(ms.store_path_for(path)), path)
+
+def test_last_row_without_newline_is_ingested(tmp_path):
+    path = str(tmp_path / "db.csv")
+    write_csv(path, ROWS, newline_at_end=False)
+    settle(path)
+    ms.refresh_store(path)
+    assert stored_rows(path) == ROWS
+    assert is_current(path)
+    assert ms.refresh_store(path) == "fresh"
+
+def test_unsettled_last_row_waits_then_ingested(tmp_path):
+    path = str(tmp_path / "db.csv")
+    write_csv(path, ROWS, newline_at_end=False)
+    # 書いた直後は書き込み途中かもしれないので取り込まず、最新とも見なさない
+    ms.refresh_store(path)
+    assert stored_rows(path) == ROWS[:-1]
+    assert not is_current(path)
+    settle(path)
+    assert ms.refresh_store(path) != "fresh"
+    assert stored_rows(path) == ROWS
+    assert is_current(path)
+
+def test_append_after_row_without_newline(tmp_path):
+    path = str(tmp_path / "db.csv")
+    write_csv(path, ROWS, newline_at_end=False)
+    settle(path)
+    ms.refresh_store(path)
+    new = ["2026/01/03", "店A", "機種1", "1", "70", "900"]
+    ms.append_csv_rows(path, [new])
+    ms.refresh_store(path)
+    assert stored_rows(path) == ROWS + [new]
+    assert is_current(path)
+
+def test_partial_fragment_not_ingested(tmp_path):
+    path = str(tmp_path / "db.csv")
+    write_csv(path, ROWS)
+    with open(path, 'ab') as f: f.write("2026/01/03,店A,機".encode())
+    settle(path)
+    ms.refresh_store(path)
+    assert stored_rows(path) == ROWS
+    assert is_current(path)
@@ -0,0 +1,121 @@
+# --- VERSION: test_rolling.py_v1.0_20261018 ---
+# rolling_sums / rolling_means が、置き換え前の窓ごとのスライス合計とビット単位で一致するか
+
+import math
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from minrepo_store import rolling_means, rolling_sums
+
+# ==========================================
+# BLOCK: 1. 置き換え前の実装
+# ==========================================
+def old_sum(data, win):
+    return [sum(data[max(0, i - win + 1):i + 1]) for i in range(len(data))]
+
+def old_ma_partial(data, win):
+    """analyzer の calculate_ma / commander の ma7r・ma30r（先頭の欠けた窓は実在日数で割る）"""
+    return [sum(data[max(0, i - win + 1):i + 1]) / len(data[max(0, i - win + 1):i + 1]) for i in range(len(data))]
+
+def old_ma_fixed(data, win):
+    """chronicler / seeker の sum(x[i-6:i+1]) / 7（常に窓の長さで割る。先頭側は max(0, ...) で切る）"""
+    return [sum(data[max(0, i - win + 1):i + 1]) / win for i in range(len(data))]
+
+def same(a, b):
+    """NaN 同士も一致とみなし、それ以外はビット単位で比べる"""
+    return len(a) == len(b) and all((math.isnan(x) and math.isnan(y)) or x == y for x, y in zip(a, b))
+
+def payouts(n, seed):
+    """機械割らしい小数（丸めの境目に来やすい値を混ぜる）"""
+    rnd = random.Random(seed)
+    out = []
+    for _ in range(n):
+        g = rnd.choice([0, 0, rnd.randint(1, 9000)])
+        df = rnd.randint(-3000, 3000)
+        out.append(((g * 3 + df) / (max(1, g) * 3)) * 100 if g > 0 else 100.0)
+    return out
+
+WINDOWS = [1, 2, 3, 7, 15, 30]
+LENGTHS = [0, 1, 2, 6, 7, 8, 29, 30, 31, 200]
+
+# ==========================================
+# BLOCK: 2. 整数系列
+# ==========================================
+@pytest.mark.parametrize("n", LENGTHS)
+@pytest.mark.parametrize("win", WINDOWS)
+def test_int_sums_match(n, win):
+    rnd = random.Random(n * 100 + win)
+    data = [rnd.randint(-5000, 9000) for _ in range(n)]
+    got = rolling_sums([data], win)[0].tolist()
+    assert got == old_sum(data, win)
+    assert all(isinstance(v, int) for v in got)
+
+@pytest.mark.parametrize("win", WINDOWS)
+def test_int_means_match(win):
+    rnd = random.Random(win)
+    data = [rnd.randint(0, 9000) for _ in range(120)]
+    assert same(rolling_means([data], [win])[win][0].tolist(), old_ma_partial(data, win))
+    assert same(rolling_means([data], [win], fixed=True)[win][0].tolist(), old_ma_fixed(data, win))
+
+def test_int_large_values_exact():
+    # 累積和が 2**53 を超えても整数のまま差を取るので誤差が出ない
+    data = [2**50 + i for i in range(40)]
+    assert rolling_sums(np.array([data], dtype=np.int64), 7)[0].tolist() == old_sum(data, 7)
+
+# ==========================================
+# BLOCK: 3. 小数系列
+# ==========================================
+@pytest.mark.parametrize("n", LENGTHS)
+@pytest.mark.parametrize("win", WINDOWS)
+def test_float_matches_bit_for_bit(n, win):
+    data = payouts(n, n * 7 + win)
+    assert same(rolling_sums([data], win)[0].tolist(), old_sum(data, win))
+    assert same(rolling_means([data], [win])[win][0].tolist(), old_ma_partial(data, win))
+    assert same(rolling_means([data], [win], fixed=True)[win][0].tolist(), old_ma_fixed(data, win))
+
+def test_many_series_and_windows_at_once():
+    rows = [payouts(90, s) for s in range(12)]
+    res = rolling_means(rows, [3, 7, 15, 30])
+    fixed = rolling_means(np.array(rows), [3, 7, 30], fixed=True)
+    for r, data in enumerate(rows):
+        for w in (3, 7, 15, 30): assert same(res[w][r].tolist(), old_ma_partial(data, w))
+        for w in (3, 7, 30): assert same(fixed[w][r].tolist(), old_ma_fixed(data, w))
+
+def test_forward_window_as_shifted_mean():
+    # chronicler の翌3日平均 sum(x[i+1:i+4]) / 3 は、i+3 位置の固定窓平均と同じ
+    data = payouts(60, 3)
+    ma3 = rolling_means([data], [3], fixed=True)[3][0].tolist()
+    assert all(ma3[i + 3] == sum(data[i + 1:i + 4]) / 3 for i in range(len(data) - 3))
+
+def test_float_rounding_boundaries():
+    # 素朴な累積和の差なら丸め誤差が出る並び（大きな値のあとに小さな値）
+    data = [1e16, 1.0, -1e16, 0.1, 0.2, 0.3, 1e-3, 7.7] * 5
+    for w in (2, 3, 7):
+        assert same(rolling_sums([data], w)[0].tolist(), old_sum(data, w))
+
+# ==========================================
+# BLOCK: 4. NaN と短い系列
+# ==========================================
+@pytest.mark.parametrize("win", [1, 3, 7, 30])
+def test_nan_only_affects_windows_containing_it(win):
+    data = payouts(50, win)
+    for k in (0, 1, win - 1, 25, 49): data[min(k, 49)] = float('nan')
+    assert same(rolling_sums([data], win)[0].tolist(), old_sum(data, win))
+    assert same(rolling_means([data], [win])[win][0].tolist(), old_ma_partial(data, win))
+    assert same(rolling_means([data], [win], fixed=True)[win][0].tolist(), old_ma_fixed(data, win))
+
+@pytest.mark.parametrize("n", [0, 1, 2, 3])
+def test_series_shorter_than_window(n):
+    data = payouts(n, n)
+    for w in (3, 7, 30):
+        assert same(rolling_means([data], [w])[w][0].tolist(), old_ma_partial(data, w))
+        assert same(rolling_means([data], [w], fixed=True)[w][0].tolist(), old_ma_fixed(data, w))
+
+def test_one_dimensional_input():
+    data = payouts(40, 9)
+    assert same(rolling_sums(data, 7)[0].tolist(), old_sum(data, 7))
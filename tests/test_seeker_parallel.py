@@ -0,0 +1,67 @@
+# --- VERSION: test_seeker_parallel.py_v1.0_20261018 ---
+# Seeker の反転解析・パラメータ掃引が、プロセス数によらず直列実行と同じ結果になるか
+
+import csv
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import m_seeker_v1_4_The_Reversal_Map as seeker
+from minrepo_store import CSV_HEADER
+
+GRID = {"short": [5, 7], "long": [20, 30], "horizon": [1, 3], "min_units": [3, 5], "min_games": [1500, 2500]}
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    """2店舗×5機種×8台×120日の合成データ（台ごとに稼働日を間引き、店舗の癖で波を付ける）"""
+    rnd = random.Random(13)
+    rows, start = [], date(2025, 6, 1)
+    for store in ("店A本店", "店B駅前"):
+        for m in range(5):
+            for unit in range(1, 9):
+                bias = rnd.uniform(-400, 400)
+                for k in range(120):
+                    if rnd.random() < 0.15: continue
+                    g = rnd.randint(800, 8000)
+                    wave = 1500 * ((k // 9) % 2 * 2 - 1)
+                    rows.append([(start + timedelta(days=k)).strftime("%Y/%m/%d"), store, f"機種{m}",
+                                 str(unit + 100 * m), str(int(bias + wave + rnd.gauss(0, 1500))), str(g)])
+    rows.sort(key=lambda r: r[0])
+    path = tmp_path_factory.mktemp("seeker") / "db.csv"
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        csv.writer(f).writerows([CSV_HEADER] + rows)
+    return str(path)
+
+@pytest.fixture(autouse=True)
+def local_db(database, monkeypatch):
+    monkeypatch.setattr(seeker, "LOCAL_DATABASE", database)
+
+def test_study_pooled_equals_serial():
+    serial = seeker.run_full_reversal_study(workers=1)
+    assert serial
+    for workers in (2, 3):
+        assert seeker.run_full_reversal_study(workers=workers) == serial
+
+def test_sweep_pooled_equals_serial():
+    serial = seeker.run_reversal_sweep(GRID, workers=1)
+    assert serial[0] and serial[1]
+    assert seeker.run_reversal_sweep(GRID, workers=4) == serial
+
+def test_pooled_runs_are_deterministic():
+    first = seeker.collect_reversal_stats(seeker.expand_grid(GRID), workers=3)
+    again = seeker.collect_reversal_stats(seeker.expand_grid(GRID), workers=3)
+    as_plain = lambda stats: {p: {m: dict(b) for m, b in v.items()} for p, v in stats.items()}
+    assert as_plain(first) == as_plain(again)
+    # モデル・ビンの並び（初出順）まで同じ
+    assert [(p, list(v), [list(b) for b in v.values()]) for p, v in first.items()] == \
+           [(p, list(v), [list(b) for b in v.values()]) for p, v in again.items()]
+
+def test_sweep_default_params_match_study():
+    params = seeker.default_params()
+    grid = {"short": [params[0]], "long": [params[1]], "horizon": [params[2]], "min_units": [params[3]], "min_games": [params[4]]}
+    _summary, detail = seeker.run_reversal_sweep(grid, workers=2)
+    assert [r[5:] for r in detail] == [r[:5] for r in seeker.run_full_reversal_study(workers=1)]